@@ -6,22 +6,23 @@ import itsdangerous
 from sanic import response
 from sanic import Blueprint
 
-import utils.password as password
 from .schemas import USERADD_SCHEMA, LOGIN_SCHEMA
 from .helpers import route, validate
+from .ratelimit import ratelimit
 from .errors import Unauthorized
 
 bp = Blueprint(__name__)
 log = logging.getLogger(__name__)
 
-def check_password(user, given_password: str):
+async def check_password(br, user, given_password: str):
     """Check if a password is correct."""
-    salt = user['password_salt']
-    if password.pwd_hash(given_password, salt) != user['password_hash']:
+    if not given_password or \
+            not await br.check_password(user, given_password):
         raise Unauthorized('Incorrect password')
 
 
 @bp.route('/api/auth/users/add', methods=['POST'])
+@ratelimit('auth:register', 2, 60)
 @route
 async def add_user(br, request):
     """Create one user on the service."""
@@ -46,6 +47,7 @@ async def add_user(br, request):
 
 
 @bp.route('/api/auth/login', methods=['POST'])
+@ratelimit('auth:login', 5, 60)
 @route
 async def login(br, request):
     """Login one user into the service.
@@ -56,12 +58,12 @@ async def login(br, request):
     payload = request.json
 
     log.info('Trying to authenticate %r', payload['email'])
-    user = await br.get_user_by_email(payload['email'])
+    user = await br.db.fetchrow('user_login_by_email', payload['email'])
     if not user:
         raise Exception('User not found')
 
     salt = user['password_salt']
-    check_password(user, payload.get('password'))
+    await check_password(br, user, payload.get('password'))
 
     s = itsdangerous.TimestampSigner(salt)
     uid_encoded = base64.urlsafe_b64encode(user['id'].encode())
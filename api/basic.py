@@ -4,11 +4,13 @@ from sanic import Blueprint
 import lconfig
 
 from .helpers import auth_route
+from .ratelimit import ratelimit
 
 bp = Blueprint(__name__)
 
 
 @bp.route('/api/gateway')
+@ratelimit('gateway', 10, 10)
 async def get_gateway(request):
     return response.json({
         'url': lconfig.gateway_url,
@@ -16,12 +18,10 @@ async def get_gateway(request):
 
 
 @bp.get('/api/gateway/bot')
+@ratelimit('gateway:bot', 2, 5)
 @auth_route
 async def get_gateway_bot(user, br, request):
-    guild_count = await br.pool.fetchval("""
-        select count(*) from members
-        where user_id = $1
-    """, user.id)
+    guild_count = await br.guild_count(user['id'])
 
     # allocate guilds per shard
     guilds_per_shard = lconfig.GUILDS_SHARD
@@ -29,5 +29,6 @@ async def get_gateway_bot(user, br, request):
 
     return response.json({
         'gateway': lconfig.gateway_url,
-        'shards': shard_count
+        'shards': shard_count,
+        'session_start_limit': await br.session_start_limit(user['id']),
     })
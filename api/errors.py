@@ -13,6 +13,12 @@ class Unauthorized(ApiError):
     status_code = 401
 
 
+class UnknownGuild(ApiError):
+    """Unknown guild."""
+    api_errcode = 10004
+    status_code = 404
+
+
 class UnknownUser(ApiError):
     """Unknown user."""
     api_errcode = 10013
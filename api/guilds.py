@@ -1,24 +1,32 @@
 from sanic import response
 from sanic import Blueprint
 
-from .helpers import auth_route, rawguild_to_json, validate
+import utils.snowflake as snowflake
+
+from .helpers import auth_route, validate
+from .ratelimit import ratelimit
+from .serializers import GUILD
 from .schemas import GUILDADD_SCHEMA
-from ..utils import snowflake
+from .errors import UnknownGuild
 
 bp = Blueprint(__name__)
 
 
 @bp.route('/api/guilds/<guild_id:int>', methods=['GET'])
+@ratelimit('guilds:get', 30, 10)
 @auth_route
 async def get_guild(user, bridge, request, guild_id):
+    """Get a guild."""
     guild = await bridge.get_guild(guild_id)
+    if not guild:
+        raise UnknownGuild('Guild not found')
 
     # TODO: add user-specific keys.
-    guild_json = rawguild_to_json(guild)
-    return response.json(guild_json)
+    return GUILD.conditional_response(request, guild)
 
 
 @bp.route('/api/guilds', methods=['POST'])
+@ratelimit('guilds:create', 10, 3600)
 @auth_route
 async def create_guild(user, bridge, request):
     """Create guild"""
@@ -39,24 +47,7 @@ async def create_guild(user, bridge, request):
         'explicit_content_filter': payload.get('explicit_content_filter', 0),
     }
 
-    # create a guild
-    await bridge.pool.execute("""
-        insert into guilds (id, name, icon, owner_id, region)
-        values ($1, $2, $3, $4, $5)
-    """, raw_guild['id'], raw_guild['name'],
-                          raw_guild['icon'],
-                          user['id'], raw_guild['region'])
-
-    # add the owner as a member of the guild
-    await bridge.pool.execute("""
-        insert into members (user_id, guild_id)
-        values ($1, $2)
-    """, user['id'], raw_guild['id'])
-
-    # TODO: maybe communicate gateway of a guild creation
-    # and then dispatch GUILD_CREATE ?
-    # like calling bridge.dispatch, or something.
-    await bridge.ws.dispatch('NEW_GUILD',
-                             [raw_guild['id'], user['id']])
+    # create the guild, with its owner as a member
+    await bridge.create_guild(raw_guild)
 
     return response.json(raw_guild)
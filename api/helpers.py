@@ -1,23 +1,24 @@
 import logging
 
 from sanic import response
-from sanic.exceptions import ServerError
+from sanic.exceptions import ServerError, NotFound, InvalidUsage
 
-from .schemas import v
 from .errors import LitecordValidationError
+from .serializers import USER, GUILD
 
 log = logging.getLogger(__name__)
 
 
-def validate(document: dict, schema: dict) -> dict:
+def validate(document: dict, schema) -> dict:
     """Validate one document against the schema provided.
 
     Parameters
     ----------
     document: dict
         The original document to be validated.
-    schema: dict
-        The schema that this document will be validated against.
+    schema: api.schemas.Schema
+        The compiled schema that this document
+        will be validated against.
 
     Returns
     -------
@@ -31,13 +32,79 @@ def validate(document: dict, schema: dict) -> dict:
     LitecordValidationError
         On any payload error.
     """
-    res = v.validate(document, schema)
-    if not res:
-        raise LitecordValidationError('Bad payload', v.errors)
+    errors = schema.validate(document)
+    if errors:
+        raise LitecordValidationError('Bad payload', errors)
 
     return document
 
 
+def query_int(request, name: str, default: int=None, *,
+              minimum: int=None, maximum: int=None) -> int:
+    """Get an integer from the query string of a request.
+
+    Raises
+    ------
+    LitecordValidationError
+        If the parameter isn't an integer or is out of bounds.
+    """
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+
+    try:
+        value = int(raw)
+    except ValueError:
+        raise LitecordValidationError('Bad query string', {
+            name: ['must be of integer type']})
+
+    if minimum is not None and value < minimum:
+        raise LitecordValidationError('Bad query string', {
+            name: [f'min value is {minimum}']})
+
+    if maximum is not None and value > maximum:
+        raise LitecordValidationError('Bad query string', {
+            name: [f'max value is {maximum}']})
+
+    return value
+
+
+def _route(request) -> tuple:
+    """Get the ``(handler, uri)`` a request is routed to,
+    both ``None`` when it isn't routed anywhere.
+
+    The lookup is kept in the request, so middleware
+    can share it.
+    """
+    try:
+        return request['route']
+    except KeyError:
+        pass
+
+    try:
+        handler, _, _, uri = request.app.router.get(request)
+    except (NotFound, InvalidUsage):
+        handler, uri = None, None
+
+    request['route'] = (handler, uri)
+    return handler, uri
+
+
+def route_handler(request):
+    """Get the handler a request is routed to, or ``None``.
+
+    For routes with many methods, this is the handler of the
+    request method, not the view holding all of them.
+    """
+    return _route(request)[0]
+
+
+def route_uri(request) -> str:
+    """Get the URI of the route a request matched, like
+    ``/api/users/<user_id>``, or ``None``."""
+    return _route(request)[1]
+
+
 def get_token(request) -> str:
     """Get a token from a request object."""
     prefixes = ('Bearer', 'Bot')
@@ -86,40 +153,32 @@ def auth_route(handler):
                 'message': '401: Unauthorized'
             }, status=401)
 
-        succ, user_id = await bridge.token_valid(token)
+        succ, user = await bridge.token_user(token)
         if not succ:
             return response.json({
                 'code': 0,
-                'message': 'User not found [id]'
-            }, status=401)
-
-        user = await bridge.get_user(user_id)
-        if not user:
-            return response.json({
-                'code': 0,
-                'message': 'User not found [user]'
+                'message': f'Unauthorized [{user}]'
             }, status=401)
 
         return await handler(user, bridge, request, *args, **kwargs)
 
+    # lets the ratelimit middleware key the route by user
+    new_handler.requires_auth = True
     return new_handler
 
 
 def to_json(record, fields) -> dict:
-    """Convert a record with its fields to a dictionary."""
-    dct = {}
-    for field in fields:
-        dct[field] = record[field]
+    """Convert a record with its fields to a dictionary.
 
-    return dct
+    Prefer the compiled shapes in :mod:`api.serializers`
+    for anything on a hot path.
+    """
+    return {field: record[field] for field in fields}
 
 
 def user_to_json(record) -> dict:
     """Convert a raw user record to JSON."""
-    fields = ['id', 'username', 'discriminator',
-              'avatar', 'bot', 'mfa_enabled', 'flags',
-              'verified']
-    return to_json(record, fields)
+    return USER.project(record)
 
 
 def rawguild_to_json(record) -> dict:
@@ -130,11 +189,4 @@ def rawguild_to_json(record) -> dict:
     the data from here with more information
     like roles, members, etc.
     """
-    fields = ['id', 'name', 'owner_id', 'region',
-              'afk_channel_id', 'afk_timeout',
-              'embed_enabled', 'verification_level',
-              'default_message_notifications',
-              'explicit_content_fileter',
-              'mfa_level', 'widget_enabled',
-              'widget_channel_id', 'system_channel_id']
-    return to_json(record, fields)
+    return GUILD.project(record)
@@ -0,0 +1,247 @@
+"""
+metrics.py - Prometheus metrics endpoint
+
+    Request counts and latencies are recorded by the middleware
+    here, pool, cache, query and litebridge metrics are read
+    when scraped.
+
+    Every worker process has its own metrics, labeled with its
+    snowflake process id. Workers share the API port, where a
+    scrape would reach any one of them, so each one serves its
+    metrics on its own port instead, see :func:`start_server`.
+"""
+import asyncio
+import functools
+import logging
+import re
+import time
+
+import lconfig
+import utils.snowflake as snowflake
+from utils.metrics import REGISTRY
+from .helpers import route_uri
+
+log = logging.getLogger(__name__)
+
+REQUESTS = REGISTRY.counter(
+    'litecord_http_requests_total', 'HTTP requests handled.',
+    ('worker', 'method', 'route', 'status'))
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'litecord_http_request_duration_seconds',
+    'Time spent handling HTTP requests.',
+    ('worker', 'method', 'route'))
+
+POOL_MAX_SIZE = REGISTRY.gauge(
+    'litecord_db_pool_max_size', 'Maximum connections in the pool.',
+    ('worker',))
+POOL_IN_USE = REGISTRY.gauge(
+    'litecord_db_pool_in_use', 'Pool connections in use.', ('worker',))
+POOL_WAITING = REGISTRY.gauge(
+    'litecord_db_pool_waiting', 'Callers waiting for a pool connection.',
+    ('worker',))
+
+BRIDGE_CONNECTED = REGISTRY.gauge(
+    'litecord_litebridge_connected',
+    'If the litebridge connection is up.', ('worker',))
+BRIDGE_HB_RTT = REGISTRY.gauge(
+    'litecord_litebridge_heartbeat_rtt_seconds',
+    'Time between the last heartbeat and its ACK.', ('worker',))
+BRIDGE_RECONNECTS = REGISTRY.gauge(
+    'litecord_litebridge_reconnects',
+    'Connection attempts after the first one.', ('worker',))
+BRIDGE_INFLIGHT = REGISTRY.gauge(
+    'litecord_litebridge_inflight_requests',
+    'Requests waiting for a litebridge response.', ('worker',))
+BRIDGE_QUEUE = REGISTRY.gauge(
+    'litecord_litebridge_inbound_queue_depth',
+    'Litebridge requests waiting for a worker.', ('worker',))
+
+CACHE_ENTRIES = REGISTRY.gauge(
+    'litecord_cache_entries', 'Entries in a cache.', ('worker', 'cache'))
+CACHE_MAX_ENTRIES = REGISTRY.gauge(
+    'litecord_cache_max_entries', 'Maximum entries in a cache.',
+    ('worker', 'cache'))
+CACHE_HITS = REGISTRY.counter(
+    'litecord_cache_hits_total', 'Cache lookups that found an entry.',
+    ('worker', 'cache'))
+CACHE_MISSES = REGISTRY.counter(
+    'litecord_cache_misses_total', 'Cache lookups that found nothing.',
+    ('worker', 'cache'))
+CACHE_EVICTIONS = REGISTRY.counter(
+    'litecord_cache_evictions_total',
+    'Entries dropped to make room for others.', ('worker', 'cache'))
+
+QUERY_CALLS = REGISTRY.counter(
+    'litecord_db_query_calls_total', 'Calls of each named query.',
+    ('worker', 'query'))
+QUERY_SECONDS = REGISTRY.counter(
+    'litecord_db_query_seconds_total',
+    'Time spent running each named query.', ('worker', 'query'))
+
+LOADER_LOADS = REGISTRY.counter(
+    'litecord_user_loader_loads_total', 'Users asked to the loader.',
+    ('worker',))
+LOADER_COALESCED = REGISTRY.counter(
+    'litecord_user_loader_coalesced_total',
+    'Loads that joined another load of the same user.', ('worker',))
+LOADER_BATCHES = REGISTRY.counter(
+    'litecord_user_loader_batches_total', 'Queries run by the loader.',
+    ('worker',))
+LOADER_KEYS = REGISTRY.counter(
+    'litecord_user_loader_keys_fetched_total',
+    'Users fetched by the loader queries.', ('worker',))
+LOADER_MAX_BATCH = REGISTRY.gauge(
+    'litecord_user_loader_max_batch_size',
+    'Most users fetched by one loader query.', ('worker',))
+
+# asyncpg's default, when lconfig.pgargs doesn't set one
+DEFAULT_POOL_MAX_SIZE = 10
+
+# route uri -> route label, see route_label
+_route_labels = {}
+
+
+def route_label(request) -> str:
+    """Get the route of a request, as a metric label.
+
+    Versioned prefixes (/api/v6, /api/v7) are folded into /api,
+    the trailing slash aliases Sanic adds are folded into their
+    route, and requests not matching any route share one label,
+    so labels can't grow without bounds.
+    """
+    uri = route_uri(request)
+    if uri is None:
+        return 'unmatched'
+
+    label = _route_labels.get(uri)
+    if label is None:
+        label = re.sub(r'^/api/v\d+', '/api', uri)
+        if len(label) > 1:
+            label = label.rstrip('/')
+
+        _route_labels[uri] = label
+
+    return label
+
+
+async def start_timer(request):
+    """Request middleware, marking when the request started."""
+    request['start_time'] = time.perf_counter()
+
+
+async def record_request(request, res):
+    """Response middleware, recording the request
+    in the request metrics."""
+    start = request.get('start_time')
+    if start is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    worker = snowflake.PROCESS_ID
+    route = route_label(request)
+    status = res.status if res is not None else 500
+
+    REQUESTS.inc(worker, request.method, route, status)
+    REQUEST_LATENCY.observe(elapsed, worker, request.method, route)
+
+
+def _update_caches(bridge, worker):
+    caches = {
+        'token': bridge.token_cache,
+        'user': bridge.user_cache,
+        'guild_count': bridge.guild_counts,
+    }
+
+    for name, cache in caches.items():
+        stats = cache.stats()
+        CACHE_ENTRIES.set(stats['size'], worker, name)
+        CACHE_MAX_ENTRIES.set(stats['maxsize'], worker, name)
+        CACHE_HITS.set_total(stats['hits'], worker, name)
+        CACHE_MISSES.set_total(stats['misses'], worker, name)
+        CACHE_EVICTIONS.set_total(stats['evictions'], worker, name)
+
+
+def _update_queries(bridge, worker):
+    for name, stats in bridge.db.stats().items():
+        QUERY_CALLS.set_total(stats['calls'], worker, name)
+        QUERY_SECONDS.set_total(stats['total'], worker, name)
+
+    stats = bridge.user_loader.stats()
+    LOADER_LOADS.set_total(stats['loads'], worker)
+    LOADER_COALESCED.set_total(stats['coalesced'], worker)
+    LOADER_BATCHES.set_total(stats['batches'], worker)
+    LOADER_KEYS.set_total(stats['keys_fetched'], worker)
+    LOADER_MAX_BATCH.set(stats['max_batch_size'], worker)
+
+
+def _update_gauges(bridge):
+    worker = snowflake.PROCESS_ID
+
+    POOL_MAX_SIZE.set(lconfig.pgargs.get('max_size',
+                                         DEFAULT_POOL_MAX_SIZE), worker)
+    POOL_IN_USE.set(bridge.db.in_use, worker)
+    POOL_WAITING.set(bridge.db.waiting, worker)
+
+    _update_caches(bridge, worker)
+    _update_queries(bridge, worker)
+
+    conn = bridge.ws
+    if conn is None:
+        BRIDGE_CONNECTED.set(0, worker)
+        return
+
+    BRIDGE_CONNECTED.set(int(conn.good_state), worker)
+    if conn.hb_rtt is not None:
+        BRIDGE_HB_RTT.set(conn.hb_rtt, worker)
+    BRIDGE_RECONNECTS.set(conn.reconnects, worker)
+    BRIDGE_INFLIGHT.set(conn.inflight, worker)
+    BRIDGE_QUEUE.set(conn.queue_depth, worker)
+
+
+def render(bridge) -> bytes:
+    """Give every metric, in the Prometheus text format."""
+    _update_gauges(bridge)
+    return REGISTRY.render().encode()
+
+
+async def _handle_scrape(bridge, reader, writer):
+    """Answer one HTTP request on the metrics port."""
+    try:
+        request_line = await reader.readline()
+
+        # skip the headers, nothing in them matters here
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and \
+                parts[1].split(b'?')[0] == b'/metrics':
+            status = b'200 OK'
+            body = render(bridge)
+        else:
+            status = b'404 Not Found'
+            body = b'Not found\n'
+
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                     b'Content-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() +
+                     b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    except Exception:
+        log.exception('error serving metrics')
+    finally:
+        writer.close()
+
+
+async def start_server(bridge, port: int):
+    """Serve the metrics of this process on ``/metrics``
+    of its own port."""
+    host, _ = lconfig.server_url
+    server = await asyncio.start_server(
+        functools.partial(_handle_scrape, bridge), host, port)
+
+    log.info('serving metrics on port %d', port)
+    return server
@@ -0,0 +1,230 @@
+"""
+ratelimit.py - token bucket ratelimits
+
+    Routes declare their bucket with the :func:`ratelimit` decorator.
+    Each request then takes a token from its route bucket, keyed
+    by user on authenticated routes (see :func:`_route_key`) and by
+    IP everywhere else, and from the global bucket of its IP.
+
+    Buckets are kept in memory by each process, see
+    :func:`scale_buckets` for how they work with many workers.
+"""
+import logging
+import time
+
+from sanic import response
+
+import lconfig
+from .helpers import route_handler, get_token
+
+log = logging.getLogger(__name__)
+
+
+class Bucket:
+    """A ratelimit definition: ``rate`` requests every ``per`` seconds.
+
+    ``limit`` is the configured rate, ``rate`` is what each
+    process allows, see :func:`scale_buckets`.
+    """
+    __slots__ = ('name', 'limit', 'rate', 'per')
+
+    def __init__(self, name: str, rate: int, per: float):
+        self.name = name
+        self.limit = rate
+        self.rate = rate
+        self.per = per
+
+    def __repr__(self):
+        return f'<Bucket {self.name} {self.rate}/{self.per}s>'
+
+
+class BucketStore:
+    """Token bucket state for every key.
+
+    Buckets refill continuously, and a full bucket is the same
+    as no bucket at all, so old entries are dropped lazily
+    whenever the store is swept.
+    """
+    def __init__(self, sweep_interval: float=60):
+        # key -> [tokens, last update, seconds to refill completely]
+        self._state = {}
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def __len__(self):
+        return len(self._state)
+
+    def hit(self, key, bucket: Bucket, now: float=None) -> tuple:
+        """Take one token from a bucket.
+
+        Returns
+        -------
+        tuple
+            ``(allowed, remaining, reset_after)``, with ``reset_after``
+            being the seconds until the bucket is full again
+            (or until a token is available, when not allowed).
+        """
+        if now is None:
+            now = time.monotonic()
+
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        rate, per = bucket.rate, bucket.per
+        state = self._state.get(key)
+        if state is None:
+            tokens = rate
+        else:
+            tokens, last, _ = state
+            tokens = min(rate, tokens + (now - last) * rate / per)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            reset_after = (rate - tokens) * per / rate
+        else:
+            reset_after = (1 - tokens) * per / rate
+
+        self._state[key] = [tokens, now, per]
+        return allowed, int(tokens), reset_after
+
+    def sweep(self, now: float=None):
+        """Drop every bucket that refilled completely."""
+        if now is None:
+            now = time.monotonic()
+
+        full = [key for key, (_, last, per) in self._state.items()
+                if now - last >= per]
+        for key in full:
+            del self._state[key]
+
+        self._next_sweep = now + self.sweep_interval
+        log.debug('swept %d buckets, %d left', len(full), len(self._state))
+
+
+store = BucketStore()
+GLOBAL_BUCKET = Bucket('global', *lconfig.RATELIMIT_GLOBAL)
+
+# every bucket, so they can be scaled to the amount of workers
+_buckets = [GLOBAL_BUCKET]
+
+
+def scale_buckets(workers: int):
+    """Split every bucket between worker processes.
+
+    Buckets are kept by each process, and the connections of a
+    client can land on any of them, so each one only allows its
+    share of the configured rate (at least one request).
+    """
+    for bucket in _buckets:
+        bucket.rate = max(bucket.limit // workers, 1)
+
+
+def ratelimit(name: str, rate: int, per: float):
+    """Declare the ratelimit bucket of a route.
+
+    ``lconfig.RATELIMIT_OVERRIDES`` can replace the rate
+    and period of a bucket by its name.
+
+    Must be below the route decorator, so the
+    registered handler carries the bucket.
+    """
+    rate, per = lconfig.RATELIMIT_OVERRIDES.get(name, (rate, per))
+    bucket = Bucket(name, rate, per)
+    _buckets.append(bucket)
+
+    def decorator(handler):
+        handler.ratelimit = bucket
+        return handler
+
+    return decorator
+
+
+def client_ip(request) -> str:
+    """Get the IP of the client of a request."""
+    ip = request.ip
+    if isinstance(ip, tuple):
+        ip = ip[0]
+
+    return ip
+
+
+def _route_key(request, handler) -> str:
+    """Identify who is doing a request, for its route bucket.
+
+    Routes behind ``auth_route`` are keyed by user, but only when
+    the token is in the token cache, so it was already validated.
+    Checking tokens is much more expensive than the ratelimit itself.
+
+    Everything else is keyed by IP, so a made up token can't be used
+    to dodge a bucket (like login's) or to drain someone else's.
+    """
+    if getattr(handler, 'requires_auth', False):
+        token = get_token(request)
+        cached = token and request.app.bridge.token_cache.peek(token)
+        if cached:
+            user_id, _ = cached
+            return f'user:{user_id}'
+
+    return 'ip:' + str(client_ip(request))
+
+
+def _limited(bucket: Bucket, reset_after: float, is_global: bool):
+    headers = {'Retry-After': str(max(int(reset_after + 0.999), 1))}
+    if not is_global:
+        headers.update({
+            'X-RateLimit-Limit': str(bucket.rate),
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': f'{time.time() + reset_after:.3f}',
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': bucket.name,
+        })
+    else:
+        headers['X-RateLimit-Global'] = 'true'
+
+    return response.json({
+        'message': 'You are being rate limited.',
+        'retry_after': int(reset_after * 1000),
+        'global': is_global,
+    }, status=429, headers=headers)
+
+
+async def check_ratelimit(request):
+    """Request middleware, giving a 429 response
+    if the request goes over any of its buckets."""
+    now = time.monotonic()
+
+    allowed, _, reset_after = store.hit(('global', client_ip(request)),
+                                        GLOBAL_BUCKET, now)
+    if not allowed:
+        return _limited(GLOBAL_BUCKET, reset_after, True)
+
+    handler = route_handler(request)
+    bucket = getattr(handler, 'ratelimit', None)
+    if bucket is None:
+        return None
+
+    allowed, remaining, reset_after = store.hit(
+        (bucket.name, _route_key(request, handler)), bucket, now)
+
+    if not allowed:
+        log.info('ratelimited on %s: %s', bucket.name, request.path)
+        return _limited(bucket, reset_after, False)
+
+    request['ratelimit'] = (bucket, remaining, reset_after)
+    return None
+
+
+async def add_ratelimit_headers(request, res):
+    """Response middleware, giving the ratelimit headers
+    of the route bucket."""
+    state = request.get('ratelimit')
+    if state is None or res is None:
+        return
+
+    bucket, remaining, reset_after = state
+    res.headers['X-RateLimit-Limit'] = str(bucket.rate)
+    res.headers['X-RateLimit-Remaining'] = str(remaining)
+    res.headers['X-RateLimit-Reset'] = f'{time.time() + reset_after:.3f}'
+    res.headers['X-RateLimit-Reset-After'] = f'{reset_after:.3f}'
+    res.headers['X-RateLimit-Bucket'] = bucket.name
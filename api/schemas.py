@@ -1,57 +1,218 @@
 """common litecord data validation schemas.
+
+Schemas are written in (a subset of) the Cerberus rule syntax,
+and compiled at import time into standalone :class:`Schema` validators,
+which give the same error messages as Cerberus.
+
+Compiled schemas keep no state between calls,
+so they can be used from any task or thread at the same time.
 """
 
 import re
-from cerberus import Validator
 
 EMAIL_REGEX = r'(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)'
+EMAIL_RE = re.compile(EMAIL_REGEX)
+
+
+def _type_email(value) -> bool:
+    """Validate emails."""
+    return bool(EMAIL_RE.match(value))
+
 
+def _type_verification_level(value) -> bool:
+    return int(value) in (0, 1, 2, 3, 4)
 
-class LitecordValidator(Validator):
-    """Main litecord validator which implements
-    more types for the schemas."""
 
-    def _validate_type_email(self, value) -> bool:
-        """Validate emails."""
-        if re.match(EMAIL_REGEX, value):
-            return True
+def _type_msg_notifications(value) -> bool:
+    return int(value) in (0, 1)
 
-    def _validate_type_verification_level(self, value) -> bool:
-        return int(value) in (0, 1, 2, 3, 4)
 
-    def _validate_type_msg_notifications(self, value) -> bool:
-        return int(value) in (0, 1)
+def _type_explicit_content(value) -> bool:
+    return int(value) in (0, 1, 2)
 
-    def _validate_type_explicit_content(self, value) -> bool:
-        return int(value) in (0, 1, 2)
 
-    def _validate_type_image(self, value) -> bool:
-        return True
+def _type_image(value) -> bool:
+    return True
 
-v = LitecordValidator()
 
-USERADD_SCHEMA = {
+def _type_voice_region(value) -> bool:
+    return isinstance(value, str)
+
+
+# type name -> check function, which can return False
+# or raise on a bad value
+TYPES = {
+    'string': lambda value: isinstance(value, str),
+    'integer': lambda value: (isinstance(value, int) and
+                              not isinstance(value, bool)),
+    'boolean': lambda value: isinstance(value, bool),
+    'dict': lambda value: isinstance(value, dict),
+    'list': lambda value: isinstance(value, list),
+
+    'email': _type_email,
+    'verification_level': _type_verification_level,
+    'msg_notifications': _type_msg_notifications,
+    'explicit_content': _type_explicit_content,
+    'image': _type_image,
+    'voice_region': _type_voice_region,
+}
+
+
+def _compile_type(type_name: str):
+    try:
+        check = TYPES[type_name]
+    except KeyError:
+        raise ValueError(f'Unknown type {type_name!r}')
+
+    def type_check(value) -> bool:
+        try:
+            return bool(check(value))
+        except (TypeError, ValueError):
+            return False
+
+    return type_check
+
+
+def _compile_rule(rule: str, constraint):
+    """Compile one rule into a function of (value, document),
+    returning a list of errors."""
+    if rule == 'minlength':
+        def minlength(value, document):
+            if len(value) < constraint:
+                return [f'min length is {constraint}']
+            return []
+        return minlength
+
+    if rule == 'maxlength':
+        def maxlength(value, document):
+            if len(value) > constraint:
+                return [f'max length is {constraint}']
+            return []
+        return maxlength
+
+    if rule == 'dependencies':
+        deps = (constraint,) if isinstance(constraint, str) \
+            else tuple(constraint)
+
+        def dependencies(value, document):
+            return [f"field '{dep}' is required"
+                    for dep in deps if dep not in document]
+        return dependencies
+
+    raise ValueError(f'Unknown rule {rule!r}')
+
+
+def _compile_field(rules: dict):
+    """Compile the rules of one field into a function of
+    (value, document), returning a list of errors."""
+    nullable = rules.get('nullable', False)
+    type_name = rules.get('type')
+    type_check = _compile_type(type_name) if type_name else None
+
+    checks = []
+    null_checks = []
+    for rule, constraint in rules.items():
+        if rule in ('type', 'nullable'):
+            continue
+
+        check = _compile_rule(rule, constraint)
+        checks.append(check)
+
+        # null values skip every rule about the value itself
+        if rule == 'dependencies':
+            null_checks.append(check)
+
+    def validate_field(value, document) -> list:
+        errors = []
+        if value is None:
+            if not nullable:
+                errors.append('null value not allowed')
+
+            for check in null_checks:
+                errors.extend(check(value, document))
+            return errors
+
+        if type_check is not None and not type_check(value):
+            return [f'must be of {type_name} type']
+
+        for check in checks:
+            errors.extend(check(value, document))
+
+        return errors
+
+    return validate_field
+
+
+class Schema:
+    """A schema compiled into a standalone validator.
+
+    Parameters
+    ----------
+    schema: dict
+        Rules for each field, in Cerberus syntax. Supported rules
+        are ``type``, ``nullable``, ``minlength``, ``maxlength``
+        and ``dependencies``.
+    """
+    __slots__ = ('schema', '_fields')
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self._fields = {field: _compile_field(rules)
+                        for field, rules in schema.items()}
+
+    def validate(self, document) -> dict:
+        """Validate a document.
+
+        Returns
+        -------
+        dict
+            Errors for each field, empty when the document is valid.
+        """
+        if not isinstance(document, dict):
+            return {'': ['document is missing' if document is None
+                         else 'must be of dict type']}
+
+        errors = {}
+        fields = self._fields
+        for field, value in document.items():
+            validate_field = fields.get(field)
+            if validate_field is None:
+                errors[field] = ['unknown field']
+                continue
+
+            field_errors = validate_field(value, document)
+            if field_errors:
+                errors[field] = field_errors
+
+        # Cerberus gives fields in order
+        if len(errors) > 1:
+            errors = dict(sorted(errors.items()))
+
+        return errors
+
+
+USERADD_SCHEMA = Schema({
     'email': {'type': 'email'},
     'password': {'type': 'string'},
     'username': {'type': 'string', 'maxlength': 100},
-}
+})
 
-LOGIN_SCHEMA = {
+LOGIN_SCHEMA = Schema({
     'email': {'type': 'email'},
     'password': {'type': 'string'},
-}
+})
 
-USERMOD_SCHEMA = {
+USERMOD_SCHEMA = Schema({
     # TODO: discriminator
     'username': {'type': 'string', 'nullable': True},
     'avatar': {'type': 'string', 'nullable': True},
 
     # to change your email, you need your password.
-    'email': {'type': 'email', 'depedencies': 'password'},
+    'email': {'type': 'email', 'dependencies': 'password'},
     'password': {'type': 'string'}
-}
+})
 
-GUILDADD_SCHEMA = {
+GUILDADD_SCHEMA = Schema({
     'name': {'type': 'string', 'minlength': 2, 'maxlength': 100},
     'region': {'type': 'voice_region'},
 
@@ -64,4 +225,4 @@ GUILDADD_SCHEMA = {
     'explicit_content_filter': {'type': 'explicit_content', 'nullable': True},
 
     # TODO: roles, channels
-}
+})
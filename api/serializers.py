@@ -0,0 +1,201 @@
+"""
+serializers.py - compiled record to JSON projections
+
+    Each object shape is compiled once into a :class:`Shape`,
+    which projects records (asyncpg Records, UserRecords or dicts)
+    into JSON objects and encodes them straight to bytes.
+
+    Shapes can also give responses with an ``ETag``, answering
+    matching ``If-None-Match`` requests with ``304 Not Modified``.
+"""
+import hashlib
+import inspect
+
+from sanic import response
+
+import db
+import lconfig
+from utils.cache import LRUCache
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+    import json
+
+
+if ujson is not None:
+    def dumps(obj) -> bytes:
+        """Encode an object to JSON bytes."""
+        return ujson.dumps(obj, escape_forward_slashes=False).encode()
+else:
+    def dumps(obj) -> bytes:
+        """Encode an object to JSON bytes.
+
+        Gives the same output as the ujson encoder,
+        so ETags don't depend on which one is installed.
+        """
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+
+async def _write(res, data: bytes):
+    """Write to a streaming response, whether its write
+    is a coroutine or not."""
+    written = res.write(data)
+    if inspect.isawaitable(written):
+        await written
+
+
+def _compile(fields: tuple):
+    """Generate a function projecting a record into a dict
+    with the given fields.
+
+    The generated function is a single dict display, which is
+    faster than building the dict field by field.
+    """
+    body = ', '.join(f'{field!r}: record[{field!r}]' for field in fields)
+    namespace = {}
+    exec(f'def project(record):\n    return {{{body}}}\n', namespace)
+    return namespace['project']
+
+
+def etag(body: bytes) -> str:
+    """Make a strong ETag out of an encoded body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(header: str, tag: str) -> bool:
+    """Check an ``If-None-Match`` header against an ETag.
+
+    ``If-None-Match`` uses the weak comparison, so ``W/``
+    prefixes on the client side are ignored.
+    """
+    if not header:
+        return False
+
+    header = header.strip()
+    if header == '*':
+        return True
+
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+
+        if candidate == tag:
+            return True
+
+    return False
+
+
+class Shape:
+    """A compiled projection of records into JSON objects.
+
+    Parameters
+    ----------
+    name: str
+        Name of the shape, for debugging.
+    fields: tuple
+        Fields given out by the shape, in order.
+    tag_cache_size: int, optional
+        How many encoded records to keep for :meth:`Shape.tagged`,
+        by record ID. Only useful for records that are cached
+        and never modified in place, like ``UserRecord``.
+    """
+    __slots__ = ('name', 'fields', 'project', '_tags')
+
+    def __init__(self, name: str, fields, *, tag_cache_size: int=0):
+        self.name = name
+        self.fields = tuple(fields)
+
+        #: Project one record into a dictionary.
+        self.project = _compile(self.fields)
+
+        # record id -> (record, etag, body)
+        self._tags = LRUCache(tag_cache_size) if tag_cache_size else None
+
+    def __repr__(self):
+        return f'<Shape {self.name} fields={len(self.fields)}>'
+
+    def project_many(self, records) -> list:
+        """Project many records into a list of dictionaries."""
+        project = self.project
+        return [project(record) for record in records]
+
+    def encode(self, record) -> bytes:
+        """Encode one record to JSON bytes."""
+        return dumps(self.project(record))
+
+    def encode_many(self, records) -> bytes:
+        """Encode many records into a JSON array, as bytes."""
+        return dumps(self.project_many(records))
+
+    def response(self, record, status: int=200):
+        """Make a JSON response out of one record."""
+        return response.raw(self.encode(record), status=status,
+                            content_type='application/json')
+
+    def response_many(self, records, status: int=200):
+        """Make a JSON array response out of many records."""
+        return response.raw(self.encode_many(records), status=status,
+                            content_type='application/json')
+
+    def tagged(self, record) -> tuple:
+        """Encode one record, giving its ETag and body.
+
+        When the exact same record object was encoded before,
+        the cached ETag and body are given without encoding it again.
+        """
+        tags = self._tags
+        if tags is not None:
+            cached = tags.get(record['id'])
+            if cached is not None and cached[0] is record:
+                return cached[1], cached[2]
+
+        body = self.encode(record)
+        tag = etag(body)
+
+        if tags is not None:
+            tags.set(record['id'], (record, tag, body))
+
+        return tag, body
+
+    def conditional_response(self, request, record):
+        """Make a JSON response out of one record, with an ETag.
+
+        Gives an empty ``304 Not Modified`` response when the
+        request's ``If-None-Match`` has the current ETag.
+        """
+        tag, body = self.tagged(record)
+        headers = {'ETag': tag}
+
+        if etag_matches(request.headers.get('If-None-Match'), tag):
+            return response.raw(b'', status=304, headers=headers)
+
+        return response.raw(body, headers=headers,
+                            content_type='application/json')
+
+    def stream_many(self, records, status: int=200):
+        """Make a streamed JSON array response out of many records,
+        writing each one out as soon as it is encoded."""
+        async def streaming_fn(res):
+            sep = b'['
+            for record in records:
+                await _write(res, sep + self.encode(record))
+                sep = b','
+
+            await _write(res, b'[]' if sep == b'[' else b']')
+
+        return response.stream(streaming_fn, status=status,
+                               content_type='application/json')
+
+
+USER = Shape('user', db.USER_PUBLIC,
+             tag_cache_size=lconfig.USER_CACHE_SIZE)
+
+# the current user, as seen by themselves
+USER_SELF = Shape('user_self', db.USER_PUBLIC + ('email',))
+
+GUILD = Shape('guild', db.GUILD)
+
+MEMBER = Shape('member', ('user_id', 'guild_id'))
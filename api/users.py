@@ -1,7 +1,9 @@
 from sanic import response
 from sanic import Blueprint
 
-from .helpers import auth_route, user_to_json, validate
+from .helpers import auth_route, validate, query_int
+from .ratelimit import ratelimit
+from .serializers import USER, USER_SELF, GUILD
 from .errors import ApiError, Unauthorized, UnknownUser
 from .schemas import USERMOD_SCHEMA
 from .auth import check_password
@@ -11,27 +13,30 @@ bp = Blueprint(__name__)
 
 
 @bp.route('/api/users/@me')
+@ratelimit('users:me', 30, 10)
 @auth_route
 async def get_me(user, br, request):
     """Get the current user."""
-    return response.json(user_to_json(user))
+    return USER.conditional_response(request, user)
 
 
 @bp.route('/api/users/<user_id:int>')
+@ratelimit('users:get', 30, 10)
 @auth_route
 async def get_user(user, br, request, user_id):
     """Get any user."""
-    if user.bot:
+    if user['bot']:
         raise Unauthorized('Users can not use this endpoint')
 
     other = await br.get_user(user_id)
     if not other:
         raise UnknownUser('User not found')
 
-    return response.json(other.json)
+    return USER.conditional_response(request, other)
 
 
 @bp.patch('/api/users/@me')
+@ratelimit('users:patch_me', 5, 60)
 @auth_route
 async def patch_me(user, br, request):
     """Modify current user."""
@@ -41,24 +46,14 @@ async def patch_me(user, br, request):
     new_username = payload.get('username')
     if new_username and new_username != user['username']:
         # proceed for a new discrim
-        new_discrim = br.generate_discrim(new_username)
-
-        await br.pool.execute("""
-            update users
-            set discriminator=$1, username=$2
-            where id=$3
-        """, new_discrim, new_username, user['id'])
+        new_discrim = await br.change_username(user['id'], new_username)
 
         result_user['discriminator'] = new_discrim
         result_user['username'] = new_username
 
     new_avatar = payload.get('avatar')
     if new_avatar:
-        await br.pool.execute("""
-            update users
-            set avatar=$1
-            where id=$2
-        """, new_avatar, user['id'])
+        await br.change_avatar(user['id'], new_avatar)
 
         result_user['avatar'] = new_avatar
 
@@ -66,23 +61,35 @@ async def patch_me(user, br, request):
     given_password = payload.get('password')
 
     if new_email and new_email != user['email']:
-        check_password(user, given_password)
+        login_user = await br.db.fetchrow('user_login_by_id', user['id'])
+        await check_password(br, login_user, given_password)
         result_user['email'] = new_email
 
     # TODO: new_password
 
-    return response.json(result_user)
+    return USER_SELF.response(result_user)
 
 
 @bp.route('/api/users/@me/guilds')
+@ratelimit('users:me:guilds', 5, 5)
 @auth_route
 async def get_me_guilds(user, br, request):
-    # TODO: query string parameters
-    guild_list = await br.get_guilds(user.id)
-    return response.json([g.json for g in guild_list])
+    """Get the guilds the current user is in.
+
+    Takes ``before``, ``after`` and ``limit`` (1-100, default 100)
+    in the query string.
+    """
+    before = query_int(request, 'before', minimum=0)
+    after = query_int(request, 'after', minimum=0)
+    limit = query_int(request, 'limit', 100, minimum=1, maximum=100)
+
+    guild_list = await br.get_guilds(user['id'], before=before,
+                                     after=after, limit=limit)
+    return GUILD.stream_many(guild_list)
 
 
 @bp.route('/api/users/@me/guilds/<guild_id:int>', methods=['DELETE'])
+@ratelimit('users:me:guilds:leave', 5, 5)
 @auth_route
 async def leave_guild(user, br, request, guild_id):
     guild = await br.get_user_guild(user.id, guild_id)
@@ -0,0 +1,68 @@
+"""
+bench - offline micro-benchmarks for litecord rest
+
+    Every module can be run by itself from the repository root,
+    e.g. ``python -m bench.wire``, or all of them at once with
+    ``python -m bench``.
+"""
+import math
+import timeit
+
+
+def measure(func, *, number: int=None, repeat: int=5) -> dict:
+    """Time a function that takes no arguments.
+
+    The best of ``repeat`` runs is kept, since anything
+    slower than that is noise from the rest of the system.
+
+    Returns
+    -------
+    dict
+        With ``ns_per_op``, ``ops_per_sec`` and ``number``,
+        the amount of calls in each run.
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return {
+        'ns_per_op': best / number * 1e9,
+        'ops_per_sec': number / best,
+        'number': number,
+    }
+
+
+def run_cases(cases, *, repeat: int=5) -> list:
+    """Measure every ``(name, func)`` pair in ``cases``."""
+    results = []
+    for name, func in cases:
+        res = measure(func, repeat=repeat)
+        res['name'] = name
+        results.append(res)
+
+    return results
+
+
+def report(results: list):
+    """Print benchmark results as a table."""
+    width = max((len(r['name']) for r in results), default=4)
+    print(f'{"name":<{width}}  {"ns/op":>12}  {"ops/s":>14}')
+    for res in results:
+        print(f'{res["name"]:<{width}}  {res["ns_per_op"]:>12.1f}  '
+              f'{res["ops_per_sec"]:>14.1f}')
+
+
+def percentiles(samples, points=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles of some samples,
+    as ``{'p50': ..., 'p95': ..., 'p99': ...}``."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f'p{point}': None for point in points}
+
+    res = {}
+    for point in points:
+        rank = math.ceil(point / 100 * len(ordered)) - 1
+        res[f'p{point}'] = ordered[min(max(rank, 0), len(ordered) - 1)]
+
+    return res
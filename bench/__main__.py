@@ -0,0 +1,125 @@
+"""
+__main__.py - run every benchmark
+
+    Collects the cases of every benchmark module, optionally
+    saving the results as JSON and comparing them against
+    a saved baseline.
+
+    Usage:
+        python -m bench [-k filter] [-o results.json]
+        python -m bench --compare baseline.json [--threshold 0.1]
+
+    With --compare, the exit code is 1 when any case got slower
+    than the threshold allows, so it can gate a CI job.
+"""
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+
+from . import run_cases, report
+
+MODULES = ('snowflake', 'auth', 'validate', 'serialize', 'wire', 'metrics')
+
+
+def collect(modules, name_filter: str=None):
+    """Get the cases of every benchmark module.
+
+    Modules that can't be imported here (missing dependencies)
+    are skipped with a warning.
+    """
+    for module_name in modules:
+        try:
+            module = importlib.import_module(f'{__package__}.{module_name}')
+        except ImportError as err:
+            print(f'skipping {module_name}: {err}', file=sys.stderr)
+            continue
+
+        for name, func in module.cases():
+            if name_filter is None or name_filter in name:
+                yield name, func
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Compare results against a baseline, printing a table.
+
+    Returns
+    -------
+    list
+        Names of the cases that got slower by more than
+        ``threshold`` (a fraction, 0.1 is 10%).
+    """
+    base = {res['name']: res for res in baseline['results']}
+    width = max((len(r['name']) for r in results), default=4)
+    regressions = []
+
+    print(f'{"name":<{width}}  {"base ns/op":>12}  {"ns/op":>12}  '
+          f'{"change":>8}')
+    for res in results:
+        old = base.get(res['name'])
+        if old is None:
+            print(f'{res["name"]:<{width}}  {"-":>12}  '
+                  f'{res["ns_per_op"]:>12.1f}  {"new":>8}')
+            continue
+
+        change = res['ns_per_op'] / old['ns_per_op'] - 1
+        mark = ''
+        if change > threshold:
+            regressions.append(res['name'])
+            mark = '  REGRESSION'
+
+        print(f'{res["name"]:<{width}}  {old["ns_per_op"]:>12.1f}  '
+              f'{res["ns_per_op"]:>12.1f}  {change:>+8.1%}{mark}')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Litecord REST benchmarks')
+    parser.add_argument('-k', '--filter', dest='name_filter',
+                        help='only run cases with this in their name')
+    parser.add_argument('-m', '--module', action='append',
+                        choices=MODULES, help='only run these modules')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs of each case, the best one is kept')
+    parser.add_argument('-o', '--output',
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare against results from --output')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown counted as a regression, '
+                             'as a fraction (default: 0.1)')
+    args = parser.parse_args()
+
+    results = run_cases(collect(args.module or MODULES, args.name_filter),
+                        repeat=args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, fp, indent=2)
+
+    if not args.compare:
+        report(results)
+        return 0
+
+    with open(args.compare) as fp:
+        baseline = json.load(fp)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regressions over '
+              f'{args.threshold:.0%}', file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+auth.py - authentication hot path benchmark
+
+    Covers what every authenticated request and every login does:
+    getting the token out of the request, signing and checking
+    tokens with itsdangerous, and hashing passwords.
+
+    Usage: python -m bench.auth
+"""
+import base64
+import types
+
+import itsdangerous
+
+import lconfig
+import utils.password as password
+from api.helpers import get_token
+from gw import Bridge
+from . import run_cases, report
+
+USER_ID = '391651113998005248'
+SALT = password.get_random_salt()
+
+
+def _request(authorization: str):
+    """Something that looks enough like a request for get_token."""
+    return types.SimpleNamespace(headers={'Authorization': authorization})
+
+
+def cases():
+    """Benchmark cases for this module."""
+    uid_encoded = base64.urlsafe_b64encode(USER_ID.encode())
+    signer = itsdangerous.TimestampSigner(SALT)
+    token = signer.sign(uid_encoded).decode()
+
+    for kind, header in (('bearer', f'Bearer {token}'),
+                         ('bot', f'Bot {token}'),
+                         ('raw', token)):
+        request = _request(header)
+        yield f'auth:get_token:{kind}', lambda request=request: \
+            get_token(request)
+
+    yield 'auth:token_uid', lambda: Bridge._token_uid(token)
+
+    # api.auth.login makes a new signer for each login,
+    # the bridge keeps one for each salt
+    yield 'auth:sign:new_signer', lambda: \
+        itsdangerous.TimestampSigner(SALT).sign(uid_encoded)
+    yield 'auth:sign', lambda: signer.sign(uid_encoded)
+    yield 'auth:unsign:new_signer', lambda: \
+        itsdangerous.TimestampSigner(SALT).unsign(token)
+    yield 'auth:unsign', lambda: signer.unsign(token)
+
+    for scheme in password.SCHEMES:
+        cost = lconfig.PASSWORD_COST
+        stored = password.pwd_hash('hunter2', SALT, scheme, cost)
+
+        yield (f'auth:pwd_hash:{scheme}',
+               lambda scheme=scheme, cost=cost:
+               password.pwd_hash('hunter2', SALT, scheme, cost))
+        yield (f'auth:pwd_verify:{scheme}',
+               lambda stored=stored:
+               password.pwd_verify('hunter2', SALT, stored))
+
+
+def main():
+    report(run_cases(cases()))
+
+
+if __name__ == '__main__':
+    main()
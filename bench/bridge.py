@@ -0,0 +1,189 @@
+"""
+bridge.py - litebridge connection throughput benchmark
+
+    Runs gw.Connection against the stand-in server in
+    bench.bridge_server and measures:
+
+     - requests per second and their round trip times,
+     - dispatches per second, until the server got all of them,
+     - time to reconnect after the server drops the connection,
+     - time to notice missing heartbeat ACKs and reconnect.
+
+    Usage: python -m bench.bridge [--latency 0.001] [-o results.json]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import lconfig
+from gw import Connection
+from . import percentiles
+from .bridge_server import StandinServer
+
+
+class _Bridge:
+    """What Connection needs from gw.Bridge, without a database."""
+    def __init__(self, loop):
+        self.loop = loop
+
+    async def token_valid(self, token: str) -> tuple:
+        return True, token
+
+    async def tokens_user(self, tokens: list) -> list:
+        return [(True, token) for token in tokens]
+
+    def invalidate_user(self, user_id):
+        pass
+
+
+def _ms(samples) -> dict:
+    return {key: value * 1000 if value is not None else None
+            for key, value in percentiles(samples).items()}
+
+
+async def bench_requests(conn: Connection, count: int,
+                         concurrency: int) -> dict:
+    """Send ``count`` requests, ``concurrency`` at a time."""
+    rtts = []
+    remaining = iter(range(count))
+
+    async def client():
+        for idx in remaining:
+            start = time.perf_counter()
+            await conn.request('ECHO', [idx])
+            rtts.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'count': count,
+        'concurrency': concurrency,
+        'per_sec': count / elapsed,
+        'rtt_ms': _ms(rtts),
+    }
+
+
+async def bench_dispatches(conn: Connection, server: StandinServer,
+                           count: int) -> dict:
+    """Send ``count`` dispatches without waiting on each one,
+    until the server received all of them."""
+    target = server.dispatches + count
+    batches = server.batches
+
+    start = time.perf_counter()
+    for idx in range(count):
+        await conn.dispatch('BENCH', [idx], wait=False)
+
+    await server.wait_for(lambda: server.dispatches >= target, 60)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'count': count,
+        'per_sec': count / elapsed,
+        'batches': server.batches - batches,
+    }
+
+
+async def _reconnect(server: StandinServer, cause) -> float:
+    connects = server.connects
+    start = time.monotonic()
+    await cause()
+    await server.wait_for(lambda: server.connects > connects, 60)
+    return server.last_connect - start
+
+
+async def bench_reconnect(server: StandinServer, rounds: int) -> dict:
+    """Time reconnects after the server closes the connection."""
+    times = []
+    for _ in range(rounds):
+        times.append(await _reconnect(server, server.disconnect))
+
+    return {'rounds': rounds, 'ms': _ms(times)}
+
+
+async def bench_heartbeat_loss(server: StandinServer) -> dict:
+    """Time how long it takes to reconnect when
+    heartbeats stop being ACK'd."""
+    async def stop_acks():
+        server.drop_heartbeats = 1.
+
+    try:
+        elapsed = await _reconnect(server, stop_acks)
+    finally:
+        server.drop_heartbeats = 0.
+
+    return {'hb_interval': server.hb_interval, 'seconds': elapsed}
+
+
+async def run(args) -> dict:
+    server = StandinServer(hb_interval=args.hb_interval,
+                           latency=args.latency, jitter=args.jitter,
+                           compress=args.compress,
+                           batch=not args.no_batch)
+    await server.start()
+
+    lconfig.litebridge_server = server.url
+    lconfig.litebridge_password = server.password
+    if args.encoding:
+        lconfig.LITEBRIDGE_ENCODINGS = [args.encoding]
+    lconfig.LITEBRIDGE_COMPRESS = args.compress
+
+    conn = Connection(_Bridge(asyncio.get_event_loop()))
+    await conn.init()
+    await server.wait_for(lambda: server.connects > 0, 10)
+
+    results = {
+        'codec': repr(conn.codec),
+        'batching': conn.batching,
+        'latency': args.latency,
+        'jitter': args.jitter,
+    }
+
+    try:
+        results['requests'] = await bench_requests(conn, args.requests,
+                                                   args.concurrency)
+        results['dispatches'] = await bench_dispatches(conn, server,
+                                                       args.dispatches)
+        results['reconnect'] = await bench_reconnect(server, args.reconnects)
+        results['heartbeat_loss'] = await bench_heartbeat_loss(server)
+    finally:
+        conn.cleanup()
+        await conn.ws.close()
+        await server.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Litebridge benchmark')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--dispatches', type=int, default=50000)
+    parser.add_argument('--reconnects', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='seconds the server waits before answering')
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--hb-interval', type=float, default=0.5)
+    parser.add_argument('--encoding', help='force an encoding')
+    parser.add_argument('--compress', action='store_true',
+                        help='use zlib-stream compression')
+    parser.add_argument('--no-batch', action='store_true',
+                        help='do not offer dispatch batching')
+    parser.add_argument('-o', '--output',
+                        help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
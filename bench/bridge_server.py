@@ -0,0 +1,249 @@
+"""
+bridge_server.py - stand-in litebridge server
+
+    Speaks enough of the litebridge protocol (hello, heartbeats,
+    requests, responses, dispatches and batches) to run
+    gw.Connection without a real server, and can add latency,
+    drop heartbeat ACKs and disconnect clients on demand.
+
+    Used by bench.bridge, can also be run by itself to point
+    a local instance at it:
+
+        python -m bench.bridge_server [--port 10101] [--latency 0.01]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+import websockets
+
+import lconfig
+from gw import OP
+from utils.encoding import ENCODINGS, COMPRESSIONS, Codec
+
+log = logging.getLogger(__name__)
+
+
+class Peer:
+    """One client connected to the stand-in."""
+    def __init__(self, ws, codec: Codec):
+        self.ws = ws
+        self.codec = codec
+
+        # with zlib-stream, frames must be sent
+        # in the order they were encoded
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, obj):
+        async with self._send_lock:
+            await self.ws.send(self.codec.encode(obj))
+
+
+class StandinServer:
+    """A litebridge server for local testing and benchmarks.
+
+    Parameters
+    ----------
+    host: str
+    port: int
+        Port to listen on, 0 picks a free one.
+    password: str, optional
+        Password clients must give, defaults to
+        ``lconfig.litebridge_password``.
+    hb_interval: float
+        Heartbeat interval given to clients, in seconds.
+    latency: float
+        Seconds to wait before sending any response or heartbeat ACK.
+    jitter: float
+        Extra random latency, up to this many seconds.
+    drop_heartbeats: float
+        Chance (0 to 1) of not answering a heartbeat.
+    encodings: tuple
+        Encodings offered to clients, default is every one available.
+    compress: bool
+        If zlib-stream compression is offered.
+    batch: bool
+        If clients can send OP.batch frames.
+    """
+    def __init__(self, host: str='localhost', port: int=0, *,
+                 password: str=None, hb_interval: float=1,
+                 latency: float=0., jitter: float=0.,
+                 drop_heartbeats: float=0., encodings: tuple=None,
+                 compress: bool=True, batch: bool=True):
+        self.host = host
+        self.port = port
+        self.password = password or lconfig.litebridge_password
+        self.hb_interval = hb_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_heartbeats = drop_heartbeats
+        self.encodings = tuple(encodings or ENCODINGS)
+        self.compress = compress
+        self.batch = batch
+
+        #: request name -> function of the request arguments,
+        #: giving the response
+        self.handlers = {
+            'ECHO': lambda *args: list(args),
+        }
+
+        self.server = None
+        self.peers = set()
+
+        self.connects = 0
+        self.last_connect = None
+        self.heartbeats = 0
+        self.heartbeats_dropped = 0
+        self.requests = 0
+        self.dispatches = 0
+        self.batches = 0
+
+        # notified whenever a counter changes
+        self._changed = asyncio.Condition()
+
+    @property
+    def url(self) -> str:
+        return f'ws://{self.host}:{self.port}/'
+
+    async def start(self):
+        self.server = await websockets.serve(self._handler,
+                                             self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info('stand-in litebridge listening on %s', self.url)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def disconnect(self):
+        """Close the connection of every client."""
+        await asyncio.gather(*(peer.ws.close() for peer in self.peers))
+
+    async def wait_for(self, predicate, timeout: float=None):
+        """Wait until ``predicate()`` is true, checking it
+        whenever a counter changes."""
+        async def _wait():
+            async with self._changed:
+                await self._changed.wait_for(predicate)
+
+        await asyncio.wait_for(_wait(), timeout)
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _reply(self, peer: Peer, obj):
+        await self._delay()
+        try:
+            await peer.send(obj)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _handshake(self, ws) -> Peer:
+        codec = Codec()
+        await ws.send(codec.encode({
+            'op': OP.hello,
+            'hb_interval': int(self.hb_interval * 1000),
+            'encodings': list(self.encodings),
+            'compress': list(COMPRESSIONS) if self.compress else [],
+            'batch': self.batch,
+        }))
+
+        ack = codec.decode(await ws.recv())
+        if ack.get('op') != OP.hello_ack or \
+                ack.get('password') != self.password:
+            await ws.close(4001, 'Bad HELLO_ACK')
+            return None
+
+        return Peer(ws, Codec(ack.get('encoding') or 'json',
+                              ack.get('compress')))
+
+    async def _handler(self, ws, path=None):
+        peer = await self._handshake(ws)
+        if peer is None:
+            return
+
+        self.peers.add(peer)
+        self.connects += 1
+        self.last_connect = time.monotonic()
+        await self._notify()
+
+        try:
+            while True:
+                packet = peer.codec.decode(await ws.recv())
+                await self._process(peer, packet)
+        except websockets.ConnectionClosed:
+            log.debug('client disconnected')
+        finally:
+            self.peers.discard(peer)
+
+    async def _process(self, peer: Peer, packet: dict):
+        opcode = packet['op']
+
+        if opcode == OP.heartbeat:
+            self.heartbeats += 1
+            if random.random() < self.drop_heartbeats:
+                self.heartbeats_dropped += 1
+                return
+
+            asyncio.ensure_future(self._reply(peer, {
+                'op': OP.heartbeat_ack,
+                's': packet.get('s'),
+            }))
+        elif opcode == OP.request:
+            self.requests += 1
+            handler = self.handlers.get(packet['w'])
+            result = handler(*packet['a']) if handler else None
+
+            asyncio.ensure_future(self._reply(peer, {
+                'op': OP.response,
+                'r': result,
+                'n': packet['n'],
+            }))
+        elif opcode == OP.dispatch:
+            self.dispatches += 1
+            await self._notify()
+        elif opcode == OP.batch:
+            self.batches += 1
+            for sub_packet in packet['d']:
+                await self._process(peer, sub_packet)
+        else:
+            log.warning('Unknown OP code: %d', opcode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in litebridge')
+    parser.add_argument('--port', type=int, default=10101)
+    parser.add_argument('--hb-interval', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--drop-heartbeats', type=float, default=0.)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = StandinServer(port=args.port, hb_interval=args.hb_interval,
+                           latency=args.latency, jitter=args.jitter,
+                           drop_heartbeats=args.drop_heartbeats)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+
+
+if __name__ == '__main__':
+    main()
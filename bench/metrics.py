@@ -0,0 +1,43 @@
+"""
+metrics.py - metrics recording benchmark
+
+    Measures what the metrics middleware adds to every request,
+    and what rendering /metrics costs.
+
+    Usage: python -m bench.metrics
+"""
+import random
+
+from utils.metrics import Registry
+from . import run_cases, report
+
+ROUTES = ('/api/users/@me', '/api/users/<user_id:int>',
+          '/api/guilds/<guild_id:int>', '/api/users/@me/guilds')
+
+
+def cases():
+    """Benchmark cases for this module."""
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.',
+                                ('worker', 'method', 'route', 'status'))
+    latency = registry.histogram('request_duration_seconds', 'Latency.',
+                                 ('worker', 'method', 'route'))
+
+    for route in ROUTES:
+        for _ in range(1000):
+            latency.observe(random.expovariate(50), 0, 'GET', route)
+            requests.inc(0, 'GET', route, 200)
+
+    yield 'metrics:counter:inc', \
+        lambda: requests.inc(0, 'GET', '/api/users/@me', 200)
+    yield 'metrics:histogram:observe', \
+        lambda: latency.observe(0.0042, 0, 'GET', '/api/users/@me')
+    yield f'metrics:render ({len(ROUTES)} routes)', registry.render
+
+
+def main():
+    report(run_cases(cases()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+serialize.py - record to JSON benchmark
+
+    Compares the compiled shapes in api.serializers against
+    the old field-by-field helpers, for single records and for
+    lists like the one in /users/@me/guilds. The helpers still
+    in api.helpers are measured too.
+
+    Usage: python -m bench.serialize
+"""
+import json
+
+from api import helpers
+from api.serializers import USER, GUILD, MEMBER
+from db import UserRecord
+from . import run_cases, report
+
+BULK = 100
+
+USER_ROW = {
+    'id': '391651113998005248',
+    'username': 'luna',
+    'discriminator': '0042',
+    'avatar': None,
+    'bot': False,
+    'mfa_enabled': False,
+    'flags': 0,
+    'verified': True,
+    'email': 'luna@example.com',
+    'password_salt': 'c2FsdA==',
+}
+
+GUILD_ROW = {
+    'id': 391651113998005249,
+    'name': 'litecord testing',
+    'icon': None,
+    'owner_id': '391651113998005248',
+    'region': 'local',
+    'afk_channel_id': None,
+    'afk_timeout': 300,
+    'embed_enabled': False,
+    'verification_level': 0,
+    'default_message_notifications': 0,
+    'explicit_content_filter': 0,
+    'mfa_level': 0,
+    'widget_enabled': False,
+    'widget_channel_id': None,
+    'system_channel_id': None,
+}
+
+MEMBER_ROW = {
+    'user_id': '391651113998005248',
+    'guild_id': 391651113998005249,
+}
+
+
+def _legacy_to_json(record, fields) -> dict:
+    dct = {}
+    for field in fields:
+        dct[field] = record[field]
+
+    return dct
+
+
+def _legacy_user_to_json(record) -> dict:
+    fields = ['id', 'username', 'discriminator',
+              'avatar', 'bot', 'mfa_enabled', 'flags',
+              'verified']
+    return _legacy_to_json(record, fields)
+
+
+def _legacy_rawguild_to_json(record) -> dict:
+    fields = ['id', 'name', 'owner_id', 'region',
+              'afk_channel_id', 'afk_timeout',
+              'embed_enabled', 'verification_level',
+              'default_message_notifications',
+              'explicit_content_filter',
+              'mfa_level', 'widget_enabled',
+              'widget_channel_id', 'system_channel_id']
+    return _legacy_to_json(record, fields)
+
+
+def _legacy_member_to_json(record) -> dict:
+    return _legacy_to_json(record, ['user_id', 'guild_id'])
+
+
+def cases():
+    """Benchmark cases for this module."""
+    user_record = UserRecord(**USER_ROW)
+    guilds = [dict(GUILD_ROW, id=GUILD_ROW['id'] + i) for i in range(BULK)]
+
+    shapes = (
+        ('user', USER, _legacy_user_to_json, USER_ROW),
+        ('user_record', USER, _legacy_user_to_json, user_record),
+        ('guild', GUILD, _legacy_rawguild_to_json, GUILD_ROW),
+        ('member', MEMBER, _legacy_member_to_json, MEMBER_ROW),
+    )
+
+    for name, shape, legacy, record in shapes:
+        yield (f'serialize:legacy:{name}',
+               lambda legacy=legacy, record=record:
+               json.dumps(legacy(record)).encode())
+        yield (f'serialize:{name}',
+               lambda shape=shape, record=record: shape.encode(record))
+
+    yield ('serialize:helpers:to_json',
+           lambda: helpers.to_json(GUILD_ROW, GUILD.fields))
+    yield ('serialize:helpers:user_to_json',
+           lambda: helpers.user_to_json(user_record))
+    yield ('serialize:helpers:rawguild_to_json',
+           lambda: helpers.rawguild_to_json(GUILD_ROW))
+
+    yield (f'serialize:legacy:guilds x{BULK}',
+           lambda: json.dumps([_legacy_rawguild_to_json(g)
+                               for g in guilds]).encode())
+    yield f'serialize:guilds x{BULK}', lambda: GUILD.encode_many(guilds)
+
+
+def main():
+    report(run_cases(cases()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+snowflake.py - snowflake generation benchmark
+
+    Compares utils.snowflake against the old implementation,
+    which built every id out of binary strings.
+
+    Usage: python -m bench.snowflake
+"""
+import time
+
+import utils.snowflake as snowflake
+from . import run_cases, report
+
+BULK = 1000
+
+
+class _LegacyGenerator:
+    """The string-based generator, kept here for comparison."""
+    def __init__(self):
+        self.generated_ids = 0
+
+    def snowflake(self, timestamp: int) -> int:
+        genid_b = '{0:012b}'.format(self.generated_ids & 0xfff)
+        procid_b = '{0:05b}'.format(snowflake.PROCESS_ID)
+        workid_b = '{0:05b}'.format(snowflake.WORKER_ID)
+        epoch_b = '{0:042b}'.format(timestamp - snowflake.EPOCH)
+
+        self.generated_ids += 1
+        return int(f'{epoch_b}{workid_b}{procid_b}{genid_b}', 2)
+
+    def get_snowflake(self) -> int:
+        return self.snowflake(int(time.time() * 1000))
+
+    @staticmethod
+    def snowflake_time(sflake: int) -> float:
+        snowflake_b = '{0:064b}'.format(sflake)
+        return (int(snowflake_b[:42], 2) + snowflake.EPOCH) / 1000
+
+
+def cases():
+    """Benchmark cases for this module."""
+    legacy = _LegacyGenerator()
+    sample = snowflake.get_snowflake()
+    samples = snowflake.get_snowflakes(BULK)
+
+    yield 'snowflake:legacy:get_snowflake', legacy.get_snowflake
+    yield 'snowflake:get_snowflake', snowflake.get_snowflake
+    yield (f'snowflake:legacy:get_snowflake x{BULK}',
+           lambda: [legacy.get_snowflake() for _ in range(BULK)])
+    yield (f'snowflake:get_snowflakes({BULK})',
+           lambda: snowflake.get_snowflakes(BULK))
+
+    yield ('snowflake:legacy:snowflake_time',
+           lambda: legacy.snowflake_time(sample))
+    yield 'snowflake:snowflake_time', lambda: snowflake.snowflake_time(sample)
+    yield (f'snowflake:legacy:snowflake_time x{BULK}',
+           lambda: [legacy.snowflake_time(s) for s in samples])
+    yield (f'snowflake:snowflake_times({BULK})',
+           lambda: snowflake.snowflake_times(samples))
+
+
+def main():
+    report(run_cases(cases()))
+
+
+if __name__ == '__main__':
+    main()
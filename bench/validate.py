@@ -0,0 +1,85 @@
+"""
+validate.py - payload validation benchmark
+
+    Compares the compiled schemas in api.schemas against the
+    global Cerberus validator they replaced, for every schema.
+    The Cerberus side is skipped when it is not installed.
+
+    Usage: python -m bench.validate
+"""
+import re
+
+from api import schemas
+from . import run_cases, report
+
+try:
+    from cerberus import Validator
+except ImportError:
+    Validator = None
+
+# (schema name, valid document, invalid document)
+DOCUMENTS = (
+    ('USERADD_SCHEMA',
+     {'email': 'luna@example.com', 'password': 'hunter2',
+      'username': 'luna'},
+     {'email': 'luna', 'password': 2, 'username': 'l' * 200}),
+    ('LOGIN_SCHEMA',
+     {'email': 'luna@example.com', 'password': 'hunter2'},
+     {'email': 'luna@example', 'password': None}),
+    ('USERMOD_SCHEMA',
+     {'username': 'luna2', 'avatar': None},
+     {'email': 'luna@example.com', 'avatar': 1}),
+    ('GUILDADD_SCHEMA',
+     {'name': 'litecord testing', 'region': 'local', 'icon': None,
+      'verification_level': 1, 'explicit_content_filter': 2},
+     {'name': 'l', 'verification_level': 9, 'unknown': True}),
+)
+
+
+def _legacy_validator():
+    """The global Cerberus validator, as it was."""
+    class LitecordValidator(Validator):
+        def _validate_type_email(self, value) -> bool:
+            if re.match(schemas.EMAIL_REGEX, value):
+                return True
+
+        def _validate_type_verification_level(self, value) -> bool:
+            return int(value) in (0, 1, 2, 3, 4)
+
+        def _validate_type_msg_notifications(self, value) -> bool:
+            return int(value) in (0, 1)
+
+        def _validate_type_explicit_content(self, value) -> bool:
+            return int(value) in (0, 1, 2)
+
+        def _validate_type_image(self, value) -> bool:
+            return True
+
+        def _validate_type_voice_region(self, value) -> bool:
+            return isinstance(value, str)
+
+    return LitecordValidator()
+
+
+def cases():
+    """Benchmark cases for this module."""
+    legacy = _legacy_validator() if Validator else None
+
+    for name, valid, invalid in DOCUMENTS:
+        schema = getattr(schemas, name)
+        for kind, doc in (('valid', valid), ('invalid', invalid)):
+            if legacy is not None:
+                yield (f'validate:legacy:{name}:{kind}',
+                       lambda doc=doc, schema=schema:
+                       (legacy.validate(doc, schema.schema), legacy.errors))
+
+            yield (f'validate:{name}:{kind}',
+                   lambda doc=doc, schema=schema: schema.validate(doc))
+
+
+def main():
+    report(run_cases(cases()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+wire.py - litebridge frame encoding benchmark
+
+    Compares encode/decode cost and bytes on the wire of every
+    codec in utils.encoding, for typical OP.request
+    and OP.dispatch packets.
+
+    Usage: python -m bench.wire
+"""
+import itertools
+
+from utils.encoding import ENCODINGS, Codec
+from gw import OP, random_nonce
+from . import run_cases, report
+
+TOKEN = ('MzkxNjUxMTEzOTk4MDA1MjQ4.DRo5gg.'
+         'g6WWTd5zzG8vBf2U0hJVBr0aLIk')
+
+PAYLOADS = {
+    'request': {
+        'op': OP.request,
+        'w': 'TOKEN_VALIDATE',
+        'a': [TOKEN],
+        'n': '4b9f8a47d9d5a8cbb0a0e5f3d3c64b31',
+    },
+    'response': {
+        'op': OP.response,
+        'r': [False, 'bad token'],
+        'n': '4b9f8a47d9d5a8cbb0a0e5f3d3c64b31',
+    },
+    'dispatch': {
+        'op': OP.dispatch,
+        'w': 'NEW_GUILD',
+        'a': [391651113998005248, '391651113998005249'],
+    },
+}
+
+# frames measured when computing the average compressed size
+STREAM_FRAMES = 1000
+
+
+def codecs():
+    """All the codecs available here."""
+    for encoding, compress in itertools.product(ENCODINGS,
+                                                (None, 'zlib-stream')):
+        yield f'{encoding}' + (f'+{compress}' if compress else ''), \
+            encoding, compress
+
+
+def _roundtrip_cases(label, encoding, compress, pname, payload):
+    enc = Codec(encoding, compress)
+    dec = Codec(encoding, compress)
+
+    if compress is None:
+        frame = enc.encode(payload)
+        yield f'{label}:{pname}:encode', lambda: enc.encode(payload)
+        yield f'{label}:{pname}:decode', lambda: dec.decode(frame)
+    else:
+        # compressed frames depend on the stream state,
+        # so they have to go through a peer in order
+        peer = Codec(encoding, compress)
+        yield f'{label}:{pname}:encode', lambda: enc.encode(payload)
+        yield (f'{label}:{pname}:roundtrip',
+               lambda: dec.decode(peer.encode(payload)))
+
+
+def cases():
+    """Benchmark cases for this module."""
+    for label, encoding, compress in codecs():
+        for pname, payload in PAYLOADS.items():
+            yield from _roundtrip_cases(label, encoding, compress,
+                                        pname, payload)
+
+
+def sizes() -> dict:
+    """Average bytes on the wire per frame, for each codec."""
+    res = {}
+    for label, encoding, compress in codecs():
+        for pname, payload in PAYLOADS.items():
+            codec = Codec(encoding, compress)
+            total = 0
+            for _ in range(STREAM_FRAMES):
+                # a fresh nonce for each frame, otherwise the stream
+                # compresses way better than it does in real life
+                if 'n' in payload:
+                    payload = dict(payload, n=random_nonce())
+
+                frame = codec.encode(payload)
+                if isinstance(frame, str):
+                    frame = frame.encode()
+                total += len(frame)
+
+            res[f'{label}:{pname}'] = total / STREAM_FRAMES
+
+    return res
+
+
+def main():
+    report(run_cases(cases()))
+
+    print()
+    print('average bytes per frame:')
+    for name, size in sizes().items():
+        print(f'  {name:<36} {size:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
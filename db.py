@@ -1,14 +1,324 @@
+"""
+db.py - named query registry
 
+    Every query the REST side runs lives here, with explicit
+    column lists for each use case instead of ``SELECT *``.
 
-# Maybe we can use namedtuples?
+    Each query is prepared once per pooled connection (when the
+    connection is created, see :meth:`QueryRegistry.prepare`), after
+    that asyncpg reuses the prepared statement by its SQL text.
+"""
+import logging
+import time
 
-async def get_user(user_id: int):
-    pass
+log = logging.getLogger(__name__)
 
+# what anyone can see about a user
+USER_PUBLIC = ('id', 'username', 'discriminator', 'avatar',
+               'bot', 'mfa_enabled', 'flags', 'verified')
 
-async def get_guild(guild_id: int):
-    pass
+# what authenticated routes get about their own user,
+# the salt is needed to check tokens
+USER_PRIVATE = USER_PUBLIC + ('email', 'password_salt')
 
+# what is needed to check a password
+USER_LOGIN = ('id', 'email', 'password_salt', 'password_hash')
 
-async def get_channel(channel_id: int):
-    pass
+# what is given when creating a user
+USER_INSERT = ('id', 'username', 'discriminator',
+               'email', 'password_salt', 'password_hash')
+
+# unique constraint on users (username, discriminator),
+# its violations mean someone took the discriminator first
+DISCRIM_CONSTRAINT = 'users_username_discriminator_key'
+
+# what a guild is made of, without roles, channels, etc.
+GUILD = ('id', 'name', 'owner_id', 'region',
+         'afk_channel_id', 'afk_timeout',
+         'embed_enabled', 'verification_level',
+         'default_message_notifications',
+         'explicit_content_filter',
+         'mfa_level', 'widget_enabled',
+         'widget_channel_id', 'system_channel_id')
+
+# what is given when creating a guild
+GUILD_INSERT = ('id', 'name', 'icon', 'owner_id', 'region',
+                'verification_level', 'default_message_notifications',
+                'explicit_content_filter')
+
+# a guild membership
+MEMBER = ('user_id', 'guild_id')
+
+
+def _cols(columns: tuple) -> str:
+    return ', '.join(columns)
+
+
+class UserRecord:
+    """A user, with the columns in :data:`USER_PRIVATE`.
+
+    Lighter than keeping ``asyncpg.Record`` objects around in caches,
+    and supports both ``user['id']`` and ``user.id``.
+    """
+    __slots__ = USER_PRIVATE
+
+    def __init__(self, **fields):
+        for column in self.__slots__:
+            setattr(self, column, fields.get(column))
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a record from a database row."""
+        return cls(**{column: row[column] for column in cls.__slots__})
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return all(self[col] == other[col] for col in self.__slots__)
+
+    def __repr__(self):
+        return f'<UserRecord id={self.id} username={self.username!r}>'
+
+    def keys(self):
+        return self.__slots__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def replace(self, **changes):
+        """Get a copy of this record with some fields changed."""
+        fields = dict(self)
+        fields.update(changes)
+        return UserRecord(**fields)
+
+
+QUERIES = {
+    'users_by_ids': f"""
+    SELECT {_cols(USER_PRIVATE)} FROM users
+    WHERE id = ANY($1)
+    """,
+
+    'user_by_email': f"""
+    SELECT {_cols(USER_PRIVATE)} FROM users
+    WHERE email = $1
+    """,
+
+    'user_login_by_id': f"""
+    SELECT {_cols(USER_LOGIN)} FROM users
+    WHERE id = $1
+    """,
+
+    'user_login_by_email': f"""
+    SELECT {_cols(USER_LOGIN)} FROM users
+    WHERE email = $1
+    """,
+
+    # first free discriminator for a username ($1), probing
+    # from a random offset ($2) and wrapping around at $3
+    'discrim_free': """
+    SELECT d.discrim FROM (
+        SELECT lpad((((n + $2) % $3) + 1)::text, 4, '0') AS discrim
+        FROM generate_series(0, $3 - 1) AS n
+    ) AS d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM users
+        WHERE username = $1 AND discriminator = d.discrim
+    )
+    LIMIT 1
+    """,
+
+    # for bulk imports: which of some emails ($1) are taken,
+    # and which discriminators some usernames ($1) have taken
+    'emails_taken': """
+    SELECT email FROM users
+    WHERE email = ANY($1)
+    """,
+
+    'discrims_taken': """
+    SELECT username, discriminator FROM users
+    WHERE username = ANY($1)
+    """,
+
+    'user_insert': f"""
+    INSERT INTO users (discriminator, id, username,
+    email, password_salt, password_hash)
+
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING {_cols(USER_PRIVATE)}
+    """,
+
+    'user_set_username': """
+    UPDATE users
+    SET discriminator = $1, username = $2
+    WHERE id = $3
+    """,
+
+    'user_set_avatar': """
+    UPDATE users
+    SET avatar = $1
+    WHERE id = $2
+    """,
+
+    'user_set_password_hash': """
+    UPDATE users
+    SET password_hash = $1
+    WHERE id = $2
+    """,
+
+    'guild_by_id': f"""
+    SELECT {_cols(GUILD)} FROM guilds
+    WHERE id = $1
+    """,
+
+    # a guild and its owner's membership, in one statement,
+    # so either both are created or none is
+    'guild_create': f"""
+    WITH guild AS (
+        INSERT INTO guilds ({_cols(GUILD_INSERT)})
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        RETURNING {_cols(GUILD)}
+    ), owner AS (
+        INSERT INTO members ({_cols(MEMBER)})
+        SELECT owner_id, id FROM guild
+    )
+    SELECT {_cols(GUILD)} FROM guild
+    """,
+
+    # a page of a user's ($1) guilds, after or before a guild id ($2),
+    # walking the members (user_id, guild_id) primary key
+    'member_guilds_after': f"""
+    SELECT {_cols('g.' + col for col in GUILD)}
+    FROM members m
+    JOIN guilds g ON g.id = m.guild_id
+    WHERE m.user_id = $1 AND m.guild_id > $2
+    ORDER BY m.guild_id ASC
+    LIMIT $3
+    """,
+
+    'member_guilds_before': f"""
+    SELECT {_cols('g.' + col for col in GUILD)}
+    FROM members m
+    JOIN guilds g ON g.id = m.guild_id
+    WHERE m.user_id = $1 AND m.guild_id < $2
+    ORDER BY m.guild_id DESC
+    LIMIT $3
+    """,
+
+    'member_guild': f"""
+    SELECT {_cols('g.' + col for col in GUILD)}
+    FROM members m
+    JOIN guilds g ON g.id = m.guild_id
+    WHERE m.user_id = $1 AND m.guild_id = $2
+    """,
+
+    'member_delete': """
+    DELETE FROM members
+    WHERE user_id = $1 AND guild_id = $2
+    """,
+
+    'member_guild_count': """
+    SELECT count(*) FROM members
+    WHERE user_id = $1
+    """,
+}
+
+
+class _Acquire:
+    """Pool acquire context manager, counting connections
+    in use and callers waiting for one."""
+    def __init__(self, registry):
+        self.registry = registry
+        self.conn = None
+
+    async def __aenter__(self):
+        registry = self.registry
+        registry.waiting += 1
+        try:
+            self.conn = await registry.pool.acquire()
+        finally:
+            registry.waiting -= 1
+
+        registry.in_use += 1
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        self.registry.in_use -= 1
+        await self.registry.pool.release(self.conn)
+
+
+class QueryRegistry:
+    """Runs named queries from :data:`QUERIES` on a pool,
+    keeping call counts and timings for each one."""
+    def __init__(self, queries: dict=None):
+        self.pool = None
+        self.queries = dict(queries or QUERIES)
+
+        # name -> [calls, total seconds]
+        self._stats = {name: [0, 0.] for name in self.queries}
+
+        # pool connections in use, and callers waiting for one
+        self.in_use = 0
+        self.waiting = 0
+
+    def acquire(self):
+        """Acquire a connection from the pool, use it with
+        ``async with``. Connections in use and callers waiting
+        for one are counted in ``in_use`` and ``waiting``."""
+        return _Acquire(self)
+
+    async def prepare(self, conn):
+        """Prepare every query on a new connection.
+
+        Meant to be the ``init`` callback of the pool.
+        """
+        for sql in self.queries.values():
+            await conn.prepare(sql)
+
+    async def _run(self, method: str, name: str, args):
+        sql = self.queries[name]
+        start = time.perf_counter()
+        try:
+            async with self.acquire() as conn:
+                return await getattr(conn, method)(sql, *args)
+        finally:
+            stat = self._stats[name]
+            stat[0] += 1
+            stat[1] += time.perf_counter() - start
+
+    async def fetch(self, name: str, *args) -> list:
+        """Run a named query, returning all rows."""
+        return await self._run('fetch', name, args)
+
+    async def fetchrow(self, name: str, *args):
+        """Run a named query, returning the first row."""
+        return await self._run('fetchrow', name, args)
+
+    async def fetchval(self, name: str, *args):
+        """Run a named query, returning the first column
+        of the first row."""
+        return await self._run('fetchval', name, args)
+
+    async def execute(self, name: str, *args) -> str:
+        """Run a named query, returning its status."""
+        return await self._run('execute', name, args)
+
+    def stats(self) -> dict:
+        """Get call counts and timings (in seconds) for every query."""
+        res = {}
+        for name, (calls, total) in self._stats.items():
+            res[name] = {
+                'calls': calls,
+                'total': total,
+                'mean': total / calls if calls else 0.,
+            }
+
+        return res
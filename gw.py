@@ -1,11 +1,10 @@
 import logging
-import collections
-import json
 import asyncio
 import os
 import hashlib
 import random
 import base64
+import time
 
 import itsdangerous
 import asyncpg
@@ -14,9 +13,21 @@ import websockets
 import lconfig
 import utils.snowflake as snowflake
 import utils.password as password
+from db import QueryRegistry, UserRecord, GUILD_INSERT, MEMBER, \
+    DISCRIM_CONSTRAINT
+from utils.cache import LRUCache, TokenCache, UserCache
+from utils.encoding import Codec, negotiate
+from utils.loader import Loader
 
 log = logging.getLogger(__name__)
 
+# discriminators go from 0001 to 9999
+MAX_DISCRIM = 9999
+
+# how many times to try another discriminator when
+# a concurrent signup takes the one we picked
+DISCRIM_RETRIES = 5
+
 
 class OP:
     """Litebridge OP codes."""
@@ -27,6 +38,17 @@ class OP:
     request = 4
     response = 5
     dispatch = 6
+    batch = 7
+
+
+class BridgeError(Exception):
+    """A litebridge request could not be completed."""
+    pass
+
+
+class MemberError(Exception):
+    """A guild membership change is not possible."""
+    pass
 
 
 def random_nonce() -> str:
@@ -39,23 +61,42 @@ class Connection:
     def __init__(self, bridge):
         self.br = bridge
         self.ws = None
+        self.codec = Codec()
         self.good_state = False
 
         self._hb_good = True
         self._hb_seq = 0
+        self._hb_sent = None
+
+        #: seconds between our last heartbeat and its ACK
+        self.hb_rtt = None
 
         self.loop_task = None
         self.hb_task = None
+        self.worker_tasks = []
         self._retries = 0
-        self._requests = collections.defaultdict(asyncio.Event)
+
+        # inbound OP.request packets waiting for a worker
+        self._inbound = asyncio.Queue()
+
+        # dispatches waiting to be sent in one OP.batch frame,
+        # only used when the server supports it
+        self.batching = False
+        self._batch = None
+        self._batch_fut = None
+        self._batch_timer = None
+
+        # nonce -> future of the response
+        self._requests = {}
+        self._req_sem = asyncio.Semaphore(lconfig.LITEBRIDGE_MAX_INFLIGHT)
 
     async def recv(self):
         """Receive one message from the websocket."""
-        return json.loads(await self.ws.recv())
+        return self.codec.decode(await self.ws.recv())
 
     async def send(self, obj):
         """Send a message to the websocket."""
-        await self.ws.send(json.dumps(obj))
+        await self.ws.send(self.codec.encode(obj))
 
     async def heartbeat(self, hello: dict):
         """Heartbeat with the server."""
@@ -70,13 +111,19 @@ class Connection:
 
                     # Clean everything and restart:
                     # better try to restart
-                    # then see everything crash on fire
-                    self.loop_task.close()
+                    # then see everything crash on fire.
+                    # the receive loop would reconnect too once
+                    # the websocket closes, stop it so only we do
+                    self.loop_task.cancel()
+                    self.loop_task = None
                     await self.ws.close()
-                    await self.init()
+
+                    # init() cancels this task, so it can't run in it
+                    self.br.loop.create_task(self.init())
                     return
 
                 log.debug('Heartbeating with the gateway')
+                self._hb_sent = time.perf_counter()
                 await self.send({
                     'op': OP.heartbeat,
                     's': self._hb_seq,
@@ -96,49 +143,106 @@ class Connection:
         try:
             while True:
                 payload = await self.recv()
-                opcode = payload['op']
-
-                log.debug('Handling OP %d', opcode)
-                if opcode == OP.heartbeat_ack:
-                    log.debug("Gateway ACK'd our heartbeat")
-                    self._hb_good = True
-                    self._hb_seq += 1
-                else:
-                    await self.dispatch_packet(opcode, payload)
+                await self.process_packet(payload)
+        except asyncio.CancelledError:
+            log.debug('Receive loop cancelled.')
         except websockets.ConnectionClosed:
             log.info('Closed, trying to reconnect...')
 
+            # init() cancels this task, so it can't run in it
             await self.ws.close()
-            await self.init()
+            self.br.loop.create_task(self.init())
         except Exception:
             log.exception('Error in main receive loop')
 
+    async def process_packet(self, payload: dict):
+        """Process one packet coming from the receive loop."""
+        opcode = payload['op']
+
+        log.debug('Handling OP %d', opcode)
+        if opcode == OP.heartbeat_ack:
+            log.debug("Gateway ACK'd our heartbeat")
+            if self._hb_sent is not None:
+                self.hb_rtt = time.perf_counter() - self._hb_sent
+            self._hb_good = True
+            self._hb_seq += 1
+        elif opcode == OP.request:
+            # requests can take a while (database queries),
+            # give them to the workers so they don't hold
+            # the other packets, heartbeat ACKs included.
+            self._inbound.put_nowait(payload)
+        elif opcode == OP.batch:
+            for packet in payload['d']:
+                await self.process_packet(packet)
+        else:
+            await self.dispatch_packet(opcode, payload)
+
+    @property
+    def queue_depth(self) -> int:
+        """Amount of inbound requests waiting for a worker."""
+        return self._inbound.qsize()
+
+    async def handle_request(self, payload: dict):
+        """Handle one OP.request packet and send its response."""
+        rtype = payload['w']
+        rargs = payload['a']
+        nonce = payload['n']
+        handler = getattr(self, f'req_{rtype.lower()}', None)
+        if not handler:
+            log.warning('Unknown request: %s', rtype)
+            return
+
+        result = await handler(nonce, *rargs)
+        await self.send({
+            'op': OP.response,
+            'r': result,
+            'n': nonce
+        })
+
+    async def request_worker(self, worker_id: int):
+        """Handle inbound requests from the queue, forever.
+
+        Responses are matched by nonce on the other side,
+        so it is fine for workers to finish out of order.
+        """
+        queue = self._inbound
+        try:
+            while True:
+                payload = await queue.get()
+                try:
+                    await self.handle_request(payload)
+                except websockets.ConnectionClosed:
+                    log.warning('[worker:%d] connection closed while '
+                                'responding', worker_id)
+                except Exception:
+                    log.exception('[worker:%d] error handling request',
+                                  worker_id)
+        except asyncio.CancelledError:
+            log.debug('[worker:%d] cancelled', worker_id)
+
     async def dispatch_packet(self, opcode: int, payload: dict):
         """Handle a packet sent by the client.
+
+        Requests don't come here, :meth:`process_packet`
+        queues them for the request workers.
         """
-        if opcode == OP.request:
-            # Server requested something from us
-            rtype = payload['w']
-            rargs = payload['a']
-            nonce = payload['n']
-            handler = getattr(self, f'req_{rtype.lower()}', None)
+        if opcode == OP.dispatch:
+            # Server requested something from us (a dispatch)
+            name = payload['w']
+            handler = getattr(self, f'dispatch_{name.lower()}', None)
             if handler:
-                result = await handler(nonce, *rargs)
-                await self.send({
-                    'op': OP.response,
-                    'r': result,
-                    'n': nonce
-                })
+                await handler(*payload['a'])
             else:
-                log.warning('Unknown request: %s', rtype)
-
-        elif opcode == OP.dispatch:
-            # Server requested something from us (a dispatch)
-            pass
+                log.debug('Unhandled dispatch: %s', name)
         elif opcode == OP.response:
             # We requested something, server's
             # responding
-            pass
+            nonce = payload.get('n')
+            fut = self._requests.get(nonce)
+            if fut is None:
+                log.warning('Response for unknown nonce %r', nonce)
+            elif not fut.done():
+                fut.set_result(payload.get('r'))
         else:
             log.warning('Unknown OP code: %d', opcode)
 
@@ -149,27 +253,189 @@ class Connection:
             return True
         return False, err
 
-    async def dispatch(self, name: str, args):
+    async def req_token_validate_batch(self, nonce: int, tokens: list):
+        """Batch token validation handler.
+
+        Gives one result for each token, in the same order,
+        each one like the result of TOKEN_VALIDATE.
+        """
+        results = await self.br.tokens_user(tokens)
+        return [True if status else [False, err]
+                for status, err in results]
+
+    async def dispatch_user_update(self, user_id):
+        """A user was changed by another node."""
+        self.br.invalidate_user(user_id)
+
+    async def _send_logged(self, obj):
+        """Send a message, logging any errors.
+
+        Used for sends nobody is waiting on.
+        """
+        try:
+            await self.send(obj)
+        except Exception:
+            log.exception('Error while sending OP %d', obj['op'])
+
+    def _queue_batch(self, packet: dict) -> asyncio.Future:
+        """Add a packet to the current batch, starting one
+        if needed.
+
+        Returns a future that completes when the batch is sent.
+        """
+        loop = self.br.loop
+        if self._batch is None:
+            self._batch = []
+            self._batch_fut = loop.create_future()
+            self._batch_timer = loop.call_later(
+                lconfig.LITEBRIDGE_BATCH_WINDOW, self.flush_batch)
+
+        fut = self._batch_fut
+        self._batch.append(packet)
+        if len(self._batch) >= lconfig.LITEBRIDGE_BATCH_SIZE:
+            self.flush_batch()
+
+        return fut
+
+    def flush_batch(self):
+        """Send the current batch of dispatches right away."""
+        if self._batch is None:
+            return
+
+        batch, fut = self._batch, self._batch_fut
+        self._batch_timer.cancel()
+        self._batch = self._batch_fut = self._batch_timer = None
+
+        self.br.loop.create_task(self._send_batch(batch, fut))
+
+    async def _send_batch(self, batch: list, fut: asyncio.Future):
+        try:
+            if len(batch) == 1:
+                await self.send(batch[0])
+            else:
+                await self.send({
+                    'op': OP.batch,
+                    'd': batch,
+                })
+
+            fut.set_result(None)
+        except Exception as err:
+            log.error('Failed to send a batch of %d dispatches: %r',
+                      len(batch), err)
+            fut.set_exception(err)
+
+            # mark it as retrieved, nobody might be waiting on it
+            fut.exception()
+
+    def _drop_batch(self):
+        """Drop the current batch, failing anyone waiting on it."""
+        if self._batch is None:
+            return
+
+        self._batch_timer.cancel()
+        self._batch_fut.set_exception(BridgeError('connection lost'))
+        self._batch_fut.exception()
+        self._batch = self._batch_fut = self._batch_timer = None
+
+    async def dispatch(self, name: str, args, *, wait: bool=True):
         """Dispatch something to the server.
 
         We will not get any response back.
+
+        When the server supports batching, dispatches made within
+        ``lconfig.LITEBRIDGE_BATCH_WINDOW`` seconds of each other
+        are sent together in one OP.batch frame.
+
+        Parameters
+        ----------
+        name: str
+            Dispatch name.
+        args: list
+            Dispatch arguments.
+        wait: bool, optional
+            If we should wait until the dispatch is written to
+            the websocket. When False, this returns right away and
+            errors are only logged.
         """
-        await self.send({
+        packet = {
             'op': OP.dispatch,
             'w': name,
             'a': args,
-        })
+        }
+
+        if self.batching:
+            fut = self._queue_batch(packet)
+            if wait:
+                await asyncio.shield(fut)
+            return
 
-    async def request(self, name, args, **kwargs):
+        if wait:
+            await self.send(packet)
+        else:
+            self.br.loop.create_task(self._send_logged(packet))
+
+    @property
+    def reconnects(self) -> int:
+        """Amount of connection attempts after the first one."""
+        return max(self._retries - 1, 0)
+
+    @property
+    def inflight(self) -> int:
+        """Amount of requests waiting for a response."""
+        return len(self._requests)
+
+    async def request(self, name, args, *, timeout: float=None):
         """Request something from the server.
 
         This will block the calling coroutine until
-        a response is given.
-
-        Optionally, you can add a timeout as a keyword argument.
+        a response is given. Many requests can be in flight
+        at the same time, each one is matched back to its
+        caller by its nonce.
+
+        Parameters
+        ----------
+        name: str
+            Request type.
+        args: list
+            Arguments for the request.
+        timeout: float, optional
+            Seconds to wait for the response, defaults
+            to ``lconfig.LITEBRIDGE_REQUEST_TIMEOUT``.
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the server did not respond in time.
+        BridgeError
+            If the connection was lost before a response came.
         """
-        # TODO: implementation
-        pass
+        if timeout is None:
+            timeout = lconfig.LITEBRIDGE_REQUEST_TIMEOUT
+
+        async with self._req_sem:
+            nonce = random_nonce()
+            fut = self.br.loop.create_future()
+            self._requests[nonce] = fut
+
+            try:
+                await self.send({
+                    'op': OP.request,
+                    'w': name,
+                    'a': args,
+                    'n': nonce,
+                })
+
+                return await asyncio.wait_for(fut, timeout)
+            finally:
+                self._requests.pop(nonce, None)
+
+    def fail_requests(self, reason: str):
+        """Fail every request waiting for a response."""
+        for fut in self._requests.values():
+            if not fut.done():
+                fut.set_exception(BridgeError(reason))
+
+        self._requests.clear()
 
     async def ws_init(self):
         """Initialize the websocket
@@ -179,18 +445,38 @@ class Connection:
         if hello['op'] != OP.hello:
             raise RuntimeError('Received HELLO is not HELLO')
 
-        log.debug('Authenticating')
+        codec = negotiate(hello, lconfig.LITEBRIDGE_ENCODINGS,
+                          lconfig.LITEBRIDGE_COMPRESS)
+
+        log.debug('Authenticating, using %r', codec)
         await self.send({
             'op': OP.hello_ack,
             'password': lconfig.litebridge_password,
+            'encoding': codec.encoding,
+            'compress': codec.compress,
+            'batch': bool(hello.get('batch')),
         })
 
+        # everything after our HELLO_ACK uses the negotiated codec
+        self.codec = codec
+        self.batching = bool(hello.get('batch'))
+        self._hb_good = True
+        self.good_state = True
+
         log.debug('firing tasks')
         self.loop_task = self.br.loop.create_task(self.loop())
         self.hb_task = self.br.loop.create_task(self.heartbeat(hello))
+        self.worker_tasks = [
+            self.br.loop.create_task(self.request_worker(idx))
+            for idx in range(lconfig.LITEBRIDGE_WORKERS)
+        ]
 
     def cleanup(self):
         """Destroy any websocket-processing tasks."""
+        self.fail_requests('connection lost')
+        self._drop_batch()
+        self.batching = False
+
         if self.loop_task:
             self.loop_task.cancel()
             self.loop_task = None
@@ -199,6 +485,14 @@ class Connection:
             self.hb_task.cancel()
             self.hb_task = None
 
+        for task in self.worker_tasks:
+            task.cancel()
+
+        self.worker_tasks = []
+
+        # requests from the old connection can't be answered anymore
+        self._inbound = asyncio.Queue()
+
     async def init(self):
         """Connect to the bridge websocket and start
         the processing tasks."""
@@ -207,6 +501,7 @@ class Connection:
             self._retries += 1
 
             log.info('Connecting to the gateway [try: %d]...', self._retries)
+            self.codec = Codec()
             self.ws = await websockets.connect(lconfig.litebridge_server)
             await self.ws_init()
         except Exception as err:
@@ -220,110 +515,517 @@ class Connection:
 
 
 class Bridge:
+    MemberError = MemberError
+
     def __init__(self, app, server, loop):
         self.server = server
         self.loop = loop
 
         self.ws = None
         self.pool = None
+        self.db = QueryRegistry()
         self.app = app
 
+        self.token_cache = TokenCache(lconfig.TOKEN_CACHE_SIZE,
+                                      lconfig.TOKEN_CACHE_TTL)
+
+        # password_salt -> TimestampSigner
+        self.signer_cache = LRUCache(lconfig.TOKEN_CACHE_SIZE)
+
+        # user id -> UserRecord, filled on reads and
+        # kept up to date by our writes
+        self.user_cache = UserCache(lconfig.USER_CACHE_SIZE,
+                                    lconfig.USER_CACHE_TTL)
+
+        # user id -> amount of guilds they're in
+        self.guild_counts = LRUCache(lconfig.GUILD_COUNT_CACHE_SIZE,
+                                     lconfig.GUILD_COUNT_CACHE_TTL)
+
+        # concurrent get_user calls share queries
+        self.user_loader = Loader(self._load_users,
+                                  max_batch=lconfig.USER_LOADER_BATCH)
+
         # aliases to this instance
         app.bridge = self
 
     async def init(self):
         """Connect to database and instantiate a websocket connection."""
-        self.pool = await asyncpg.create_pool(**lconfig.pgargs)
+        password.configure(lconfig.PASSWORD_SCHEME, lconfig.PASSWORD_COST,
+                           lconfig.PASSWORD_EXECUTOR,
+                           lconfig.PASSWORD_WORKERS,
+                           lconfig.PASSWORD_MAX_PENDING)
+        self.pool = await asyncpg.create_pool(init=self.db.prepare,
+                                              **lconfig.pgargs)
+        self.db.pool = self.pool
         self.ws = Connection(self)
 
         self.loop.create_task(self.server)
         self.loop.create_task(self.ws.init())
 
-    async def token_valid(self, token: str) -> tuple:
-        """Check if a token is valid."""
-        encoded_uid, _, _ = token.split('.')
-        uid = base64.urlsafe_b64decode(encoded_uid).decode('utf-8')
-
-        log.debug('uid: %r', uid)
-
-        user = await self.get_user(uid)
+    @staticmethod
+    def _token_uid(token: str) -> str:
+        """Get the user ID encoded in a token, or ``None``
+        for malformed tokens."""
+        try:
+            encoded_uid, _, _ = token.split('.')
+            return base64.urlsafe_b64decode(encoded_uid).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _signer(self, salt: str) -> itsdangerous.TimestampSigner:
+        """Get a (cached) signer for a salt."""
+        signer = self.signer_cache.get(salt)
+        if signer is None:
+            signer = itsdangerous.TimestampSigner(salt)
+            self.signer_cache.set(salt, signer)
+
+        return signer
+
+    def _check_token(self, token: str, uid: str, user) -> tuple:
+        """Check a token's signature against its user,
+        caching it when valid."""
         if not user:
             return False, 'user not found'
 
-        salt = user['password_salt']
-        signer = itsdangerous.TimestampSigner(salt)
         try:
-            signer.unsign(token)
-            return True, uid
+            self._signer(user['password_salt']).unsign(token)
         except itsdangerous.BadSignature:
             return False, 'bad token'
 
-    async def get_user(self, user_id) -> asyncpg.Record:
-        """Get one user in the service."""
-        user = await self.pool.fetchrow("""
-        SELECT * FROM users
-        WHERE id=$1
-        """, user_id)
+        self.token_cache.set(token, (uid, user))
+        return True, user
+
+    async def token_user(self, token: str) -> tuple:
+        """Validate a token and get the user it belongs to.
+
+        Validated tokens are cached together with their user,
+        so a cache hit costs no database queries.
+
+        Returns
+        -------
+        tuple
+            ``(True, user)`` on success, ``(False, error)`` otherwise.
+        """
+        cached = self.token_cache.get(token)
+        if cached is not None:
+            _, user = cached
+            return True, user
+
+        uid = self._token_uid(token)
+        if uid is None:
+            return False, 'malformed token'
+
+        log.debug('uid: %r', uid)
+
+        user = await self.get_user(uid)
+        return self._check_token(token, uid, user)
+
+    async def tokens_user(self, tokens: list) -> list:
+        """Validate many tokens at once.
+
+        Users for tokens that aren't cached are loaded together,
+        in as few queries as the user cache and loader allow.
+
+        Returns
+        -------
+        list
+            One ``(status, user_or_error)`` tuple for each token,
+            like :meth:`Bridge.token_user`.
+        """
+        results = [None] * len(tokens)
+
+        # index in tokens -> user id
+        pending = {}
+        for idx, token in enumerate(tokens):
+            cached = self.token_cache.get(token)
+            if cached is not None:
+                results[idx] = (True, cached[1])
+                continue
+
+            uid = self._token_uid(token)
+            if uid is None:
+                results[idx] = (False, 'malformed token')
+            else:
+                pending[idx] = uid
+
+        uids = list(set(pending.values()))
+        users = dict(zip(uids, await asyncio.gather(
+            *(self.get_user(uid) for uid in uids))))
+
+        for idx, uid in pending.items():
+            results[idx] = self._check_token(tokens[idx], uid, users[uid])
 
-        log.info('[user:by_id] %s -> %r', user_id, user)
+        return results
+
+    async def token_valid(self, token: str) -> tuple:
+        """Check if a token is valid."""
+        status, res = await self.token_user(token)
+        if not status:
+            return False, res
+
+        return True, str(res['id'])
+
+    def invalidate_user(self, user_id):
+        """Drop any cached state for a user.
+
+        This must be called whenever a user record is changed
+        outside of this process, especially its ``password_salt``,
+        since that is the key used to sign tokens.
+        """
+        user_id = str(user_id)
+        self.user_cache.pop(user_id)
+        dropped = self.token_cache.invalidate_user(user_id)
+        log.debug('[user:invalidate] %s, %d tokens', user_id, dropped)
+
+    async def user_updated(self, user_id, **changes):
+        """Record changes we made to a user.
+
+        Updates the cached user, drops its cached tokens and tells
+        the other nodes (through litebridge) to drop theirs.
+        """
+        user_id = str(user_id)
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            self.user_cache.set(user_id, user.replace(**changes))
+
+        self.token_cache.invalidate_user(user_id)
+
+        if self.ws is not None:
+            await self.ws.dispatch('USER_UPDATE', [user_id], wait=False)
+
+    def _cache_user(self, row) -> UserRecord:
+        """Put a user row in the user cache."""
+        user = UserRecord.from_row(row)
+        self.user_cache.set(str(user.id), user)
         return user
 
-    async def get_user_by_email(self, email: str) -> dict:
-        """Get one user by its email in the service."""
-        user = await self.pool.fetchrow("""
-        SELECT * FROM users
-        WHERE email=$1
-        """, email)
+    async def _load_users(self, user_ids: list) -> dict:
+        """Load many users in one query, for the user loader."""
+        rows = await self.db.fetch('users_by_ids', user_ids)
+        return {row['id']: self._cache_user(row) for row in rows}
+
+    async def get_user(self, user_id) -> UserRecord:
+        """Get one user in the service.
+
+        Has the columns in ``db.USER_PRIVATE``.
+
+        Users are cached. On a miss, lookups of the same user at the
+        same time share one query, and lookups of different users made
+        in the same event loop iteration are done in one query.
+        """
+        user_id = str(user_id)
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = await self.user_loader.load(user_id)
+
+        log.debug('[user:by_id] %s -> %r', user_id, user)
+        return user
+
+    async def get_user_by_email(self, email: str) -> UserRecord:
+        """Get one user by its email in the service.
+
+        Has the columns in ``db.USER_PRIVATE``.
+        """
+        user = self.user_cache.get_by_email(email)
+        if user is None:
+            row = await self.db.fetchrow('user_by_email', email)
+            user = self._cache_user(row) if row else None
 
-        log.info('[user:by_email] %s -> %r', email, user)
+        log.debug('[user:by_email] %s -> %r', email, user)
         return user
 
+    async def get_guilds(self, user_id, *, before: int=None,
+                         after: int=None, limit: int=100) -> list:
+        """Get a page of the guilds a user is in, ordered by ID.
+
+        Pages are keyset based, each one is a range scan on the
+        ``members (user_id, guild_id)`` index, so their cost doesn't
+        depend on how deep into the list they are.
+
+        Parameters
+        ----------
+        before: int, optional
+            Only give guilds with IDs lower than this.
+        after: int, optional
+            Only give guilds with IDs higher than this.
+            Ignored when ``before`` is given.
+        limit: int
+            Maximum amount of guilds in the page.
+        """
+        if before is not None:
+            guilds = await self.db.fetch('member_guilds_before', user_id,
+                                         before, limit)
+            guilds.reverse()
+            return guilds
+
+        return await self.db.fetch('member_guilds_after', user_id,
+                                   after or 0, limit)
+
+    async def guild_count(self, user_id) -> int:
+        """Get the amount of guilds a user is in.
+
+        Counts are cached, and kept up to date by membership
+        changes made through this bridge. Changes made by other
+        processes show up once the cached count expires.
+        """
+        user_id = str(user_id)
+        count = self.guild_counts.get(user_id)
+        if count is None:
+            count = await self.db.fetchval('member_guild_count', user_id)
+            self.guild_counts.set(user_id, count)
+
+        return count
+
+    async def session_start_limit(self, user_id) -> dict:
+        """Get how many sessions a bot can still start.
+
+        Identifies are counted by the gateway, so it is asked
+        through a ``SESSION_START_LIMIT`` litebridge request, which
+        gives ``remaining`` and ``reset_after`` (in milliseconds).
+        When it can't answer, the whole limit is given.
+        """
+        limit = {
+            'total': lconfig.SESSION_START_LIMIT,
+            'remaining': lconfig.SESSION_START_LIMIT,
+            'reset_after': lconfig.SESSION_START_RESET * 1000,
+        }
+
+        if self.ws is None or not self.ws.good_state:
+            return limit
+
+        try:
+            res = await self.ws.request('SESSION_START_LIMIT', [str(user_id)],
+                                        timeout=lconfig.SESSION_START_TIMEOUT)
+            limit['remaining'] = res['remaining']
+            limit['reset_after'] = res['reset_after']
+        except (asyncio.TimeoutError, BridgeError, websockets.ConnectionClosed,
+                KeyError, TypeError) as err:
+            log.warning('[session_start_limit] gateway did not answer: %r',
+                        err)
+
+        return limit
+
+    def guild_count_changed(self, user_id, delta: int):
+        """Adjust the cached guild count of a user."""
+        user_id = str(user_id)
+        count = self.guild_counts.get(user_id)
+        if count is not None:
+            self.guild_counts.set(user_id, max(count + delta, 0))
+
+    async def create_guild(self, guild: dict):
+        """Create a guild, with its owner as its first member.
+
+        The guild and the membership are inserted by a single
+        statement, so a failure can't leave a guild without its owner.
+
+        Parameters
+        ----------
+        guild: dict
+            Has the columns in ``db.GUILD_INSERT``.
+
+        Returns
+        -------
+        asyncpg.Record
+            The new guild, with the columns in ``db.GUILD``.
+        """
+        row = await self.db.fetchrow('guild_create',
+                                     *(guild.get(col) for col in GUILD_INSERT))
+        self.guild_count_changed(guild['owner_id'], 1)
+
+        # TODO: maybe communicate gateway of a guild creation
+        # and then dispatch GUILD_CREATE ?
+        await self.ws.dispatch('NEW_GUILD', [guild['id'], guild['owner_id']],
+                               wait=False)
+        return row
+
+    async def create_guilds(self, guilds: list, *,
+                            chunk_size: int=5000) -> int:
+        """Create many guilds at once, for seeding and migrations.
+
+        Guilds and their owner memberships are loaded with COPY,
+        each chunk in its own transaction. The NEW_GUILD dispatches
+        are batched by the connection when litebridge supports it.
+
+        Parameters
+        ----------
+        guilds: list
+            Guilds, each one with the columns in ``db.GUILD_INSERT``.
+        chunk_size: int, optional
+            How many guilds to load in each transaction.
+
+        Returns
+        -------
+        int
+            The amount of guilds created.
+        """
+        created = 0
+        for idx in range(0, len(guilds), chunk_size):
+            chunk = guilds[idx:idx + chunk_size]
+            guild_rows = [tuple(guild.get(col) for col in GUILD_INSERT)
+                          for guild in chunk]
+            member_rows = [(guild['owner_id'], guild['id'])
+                           for guild in chunk]
+
+            async with self.db.acquire() as conn:
+                async with conn.transaction():
+                    await conn.copy_records_to_table(
+                        'guilds', records=guild_rows, columns=GUILD_INSERT)
+                    await conn.copy_records_to_table(
+                        'members', records=member_rows, columns=MEMBER)
+
+            created += len(chunk)
+            log.info('[guild:bulk] created %d/%d guilds',
+                     created, len(guilds))
+
+            for guild in chunk:
+                self.guild_count_changed(guild['owner_id'], 1)
+                await self.ws.dispatch('NEW_GUILD',
+                                       [guild['id'], guild['owner_id']],
+                                       wait=False)
+
+        return created
+
+    async def get_guild(self, guild_id: int):
+        """Get one guild, with the columns in ``db.GUILD``."""
+        return await self.db.fetchrow('guild_by_id', guild_id)
+
+    async def get_user_guild(self, user_id, guild_id: int):
+        """Get a guild, only if the user is a member of it."""
+        return await self.db.fetchrow('member_guild', str(user_id), guild_id)
+
+    async def pop_member(self, guild, user):
+        """Remove a user from a guild.
+
+        Raises
+        ------
+        MemberError
+            If the user owns the guild.
+        """
+        if str(guild['owner_id']) == str(user['id']):
+            raise MemberError('guild owners can not leave their guild')
+
+        await self.db.execute('member_delete', str(user['id']), guild['id'])
+        self.guild_count_changed(user['id'], -1)
+
     async def generate_discrim(self, username: str) -> str:
-        """Generate a discriminator based on a username."""
-        # First, get amount of users
+        """Generate a discriminator based on a username.
 
-        discrims = await self.pool.fetch("""
-        SELECT (discriminator) FROM users WHERE username = $1;
-        """, username)
+        Finds a free discriminator in one query, probing the
+        ``(username, discriminator)`` unique index from a random
+        starting point and wrapping around at 9999, so it
+        is cheap even when the username is almost full.
 
-        print(discrims)
-        if len(discrims) >= 9999:
+        Two concurrent signups can still pick the same value,
+        callers must retry on a unique violation,
+        see :meth:`Bridge.create_user`.
+        """
+        offset = random.randrange(MAX_DISCRIM)
+        rdiscrim = await self.db.fetchval('discrim_free', username,
+                                          offset, MAX_DISCRIM)
+
+        if rdiscrim is None:
             # Dropping it because we already have too much
             raise Exception('Too many users have this username')
 
-        # Check if random discrim is already used
-        # and if it is already used, generate another one
-        # TODO: use SQL for this ??
-        rdiscrim = await password.random_digits(4)
-
-        while rdiscrim in discrims:
-            rdiscrim = await password.random_digits(4)
-
         log.info('Generated discrim %s for %r',
                  rdiscrim, username)
 
         return rdiscrim
 
+    async def _with_discrim(self, username: str, query: str, *args,
+                            method: str='execute') -> tuple:
+        """Run a named query that takes a new discriminator as its
+        first argument, retrying with another discriminator
+        when a concurrent request took it first.
+
+        Other unique violations (a taken email or ID) are raised.
+
+        Returns the discriminator used and the query result.
+        """
+        for attempt in range(DISCRIM_RETRIES):
+            discrim = await self.generate_discrim(username)
+            try:
+                res = await getattr(self.db, method)(query, discrim, *args)
+                return discrim, res
+            except asyncpg.UniqueViolationError as err:
+                if err.constraint_name != DISCRIM_CONSTRAINT:
+                    raise
+
+                log.warning('discrim %s for %r taken, retrying [try: %d]',
+                            discrim, username, attempt + 1)
+
+        raise Exception('Failed to allocate a discriminator')
+
     async def create_user(self, payload: dict):
         """Create one user, given a user payload."""
         # create a snowflake
         user_id = snowflake.get_snowflake()
         log.info('Generated snowflake %d', user_id)
 
-        discrim = await self.generate_discrim(payload['username'])
-
         # generate passwords
         salt = password.get_random_salt()
-        pwd_hash = password.pwd_hash(payload['password'],
-                                     salt)
+        pwd_hash = await password.pwd_hash_async(payload['password'],
+                                                 salt)
+
+        _, row = await self._with_discrim(
+            payload['username'], 'user_insert', str(user_id),
+            payload['username'], payload['email'], salt, pwd_hash,
+            method='fetchrow')
+
+        if row is None:
+            return 0
+
+        self._cache_user(row)
+        return 1
+
+    async def check_password(self, user, given_password: str) -> bool:
+        """Check if a password is correct for a user.
+
+        Hashes using an older scheme or cost are upgraded
+        on a successful check, unless hashing is too busy,
+        then it waits for a later login.
 
-        res = await self.pool.execute("""
-        INSERT INTO users (id, username, discriminator,
-        email, password_salt, password_hash)
+        The user must have the columns in ``db.USER_LOGIN``.
+
+        Raises
+        ------
+        password.HashingBusy
+            If too many hashes are already queued.
+        """
+        salt = user['password_salt']
+        stored = user['password_hash']
+        if not await password.pwd_verify_async(given_password, salt, stored):
+            return False
+
+        if password.needs_rehash(stored):
+            try:
+                new_hash = await password.pwd_hash_async(given_password,
+                                                         salt)
+            except password.HashingBusy:
+                return True
+
+            await self.db.execute('user_set_password_hash',
+                                  new_hash, user['id'])
+
+            log.info('[user:rehash] upgraded password hash for %s',
+                     user['id'])
+
+        return True
+
+    async def change_username(self, user_id, username: str) -> str:
+        """Change a user's username, giving them a new
+        discriminator.
+
+        Returns the new discriminator.
+        """
+        discrim, _ = await self._with_discrim(
+            username, 'user_set_username', username, user_id)
 
-        VALUES ($1, $2, $3, $4, $5, $6)
-        """, str(user_id), payload['username'], discrim,
-                                      payload['email'], salt, pwd_hash)
+        await self.user_updated(user_id, username=username,
+                                discriminator=discrim)
+        return discrim
 
-        _, _, rows = res.split()
-        return int(rows)
+    async def change_avatar(self, user_id, avatar: str):
+        """Change a user's avatar."""
+        await self.db.execute('user_set_avatar', avatar, user_id)
+        await self.user_updated(user_id, avatar=avatar)
@@ -6,6 +6,11 @@ ssl = False
 ssl_certfile = ''
 ssl_keyfile = ''
 
+# snowflake worker id of this machine, from 0 to 31.
+# every machine running litecord must have a different one,
+# processes in it are told apart by their process id.
+WORKER_ID = 1
+
 # Where the gateway is in the world
 gateway_url = 'ws://localhost:8081/gw'
 
@@ -13,6 +18,27 @@ gateway_url = 'ws://localhost:8081/gw'
 litebridge_server = 'ws://localhost:10101/'
 litebridge_password = '123'
 
+# maximum amount of requests waiting for a response
+# from litebridge, and how long to wait for each one
+LITEBRIDGE_MAX_INFLIGHT = 1000
+LITEBRIDGE_REQUEST_TIMEOUT = 10
+
+# amount of tasks handling requests coming from litebridge,
+# which is how many of them run at the same time
+LITEBRIDGE_WORKERS = 16
+
+# frame encodings we accept from litebridge, best first,
+# and if we want zlib-stream compression when the server has it.
+# 'msgpack' requires the msgpack package.
+LITEBRIDGE_ENCODINGS = ['msgpack', 'json']
+LITEBRIDGE_COMPRESS = False
+
+# dispatches sent within this window (in seconds) are coalesced
+# into one frame, up to LITEBRIDGE_BATCH_SIZE dispatches per frame,
+# if the server supports it.
+LITEBRIDGE_BATCH_WINDOW = 0.005
+LITEBRIDGE_BATCH_SIZE = 100
+
 # Postgres arguments
 pgargs = {
     'user': 'litecord',
@@ -21,7 +47,63 @@ pgargs = {
     'host': 'localhost',
 }
 
+# password hashing. new hashes use PASSWORD_SCHEME at PASSWORD_COST,
+# older ones are upgraded on login. hashes run on a 'thread' or
+# 'process' pool of PASSWORD_WORKERS workers (None for the default),
+# with at most PASSWORD_MAX_PENDING of them queued or running,
+# requests needing a hash over that get a 503.
+PASSWORD_SCHEME = 'pbkdf2_sha256'
+PASSWORD_COST = 100000
+PASSWORD_EXECUTOR = 'thread'
+PASSWORD_WORKERS = None
+PASSWORD_MAX_PENDING = 8
+
+# cache of how many guilds each user is in, used to
+# calculate shard counts. size in entries, ttl in seconds
+GUILD_COUNT_CACHE_SIZE = 10000
+GUILD_COUNT_CACHE_TTL = 60
+
+# how many sessions a bot can start in a SESSION_START_RESET
+# seconds window, given on /gateway/bot. how many are left is
+# asked to the gateway, waiting SESSION_START_TIMEOUT seconds
+# before giving the whole limit
+SESSION_START_LIMIT = 1000
+SESSION_START_RESET = 86400
+SESSION_START_TIMEOUT = 2
+
 # recommended amount is 1000 guilds for each shard
 # changing this can lead to overall service degradation
 # on high loads
 GUILDS_SHARD = 1000
+
+# validated token cache, size in entries and
+# time to live in seconds
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+
+# maximum amount of user records kept in memory, and
+# how long (in seconds) one is used before reloading it.
+# the ttl bounds how stale a record can get when a change
+# made by another process or node never reaches us
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 300
+
+# maximum amount of users fetched in one query
+# when many are requested at the same time
+USER_LOADER_BATCH = 500
+
+# ratelimits, RATELIMIT_ENABLED = False turns all of them off.
+# global ratelimit for each IP, as (requests, seconds).
+# route ratelimits are declared next to each route, and can be
+# changed here by bucket name, like {'auth:login': (10, 60)}.
+# buckets are kept by each process, with run.py --workers N every
+# rate is divided by N (but is at least 1 request), so a client
+# spread over all workers still gets about the configured rate
+RATELIMIT_ENABLED = True
+RATELIMIT_GLOBAL = (50, 1)
+RATELIMIT_OVERRIDES = {}
+
+# each process serves its prometheus metrics on /metrics of
+# port METRICS_PORT + its snowflake process id (1 without
+# --workers, 0 to N - 1 with them). None turns this off
+METRICS_PORT = 9100
@@ -1,15 +1,29 @@
 import logging
 import asyncio
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import time
 
 from sanic import Sanic
 from sanic import response
 
+import lconfig
+import utils.snowflake as snowflake
+import utils.password as password
 from gw import Bridge
 
 import api.basic
 import api.users
 import api.auth
+import api.guilds
+import api.metrics
 from api.errors import ApiError, LitecordValidationError
+from api.ratelimit import check_ratelimit, add_ratelimit_headers, \
+    scale_buckets
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -19,12 +33,24 @@ app = Sanic(__name__)
 app.blueprint(api.basic.bp)
 app.blueprint(api.users.bp)
 app.blueprint(api.auth.bp)
+app.blueprint(api.guilds.bp)
 
 API_PREFIXES = [
     '/api/v6',
     '/api/v7'
 ]
 
+# seconds to wait before restarting a dead worker
+WORKER_RESTART_DELAY = 1
+
+
+# the timer goes first, so ratelimited requests are measured too
+app.register_middleware(api.metrics.start_timer, 'request')
+if lconfig.RATELIMIT_ENABLED:
+    app.register_middleware(check_ratelimit, 'request')
+    app.register_middleware(add_ratelimit_headers, 'response')
+app.register_middleware(api.metrics.record_request, 'response')
+
 
 @app.route('/')
 async def index(request):
@@ -54,6 +80,16 @@ def handle_api_error(request, exception):
     }, status=exception.status_code)
 
 
+@app.exception(password.HashingBusy)
+def handle_hashing_busy(request, exception):
+    """Handle password hashing being overloaded."""
+    log.warning('Password hashing is busy')
+    return response.json({
+        'code': 0,
+        'message': 'Service unavailable, try again later',
+    }, status=503, headers={'Retry-After': '1'})
+
+
 @app.exception(Exception)
 def handle_exception(request, exception):
     """Handle a general exception in the API."""
@@ -64,9 +100,8 @@ def handle_exception(request, exception):
     }, status=500)
 
 
-def main():
-    """Main entrypoint"""
-
+def add_prefixed_routes():
+    """Make /api, /api/v6 and /api/v7 route to the same handlers."""
     # this is a hack to make /api, /api/v6 and /api/v7
     # route to the same shit
     for uri in list(app.router.routes_all.keys()):
@@ -80,14 +115,138 @@ def main():
             if not app.router.routes_all.get(replaced):
                 app.add_route(handler, replaced)
 
-    server = app.create_server(host="0.0.0.0", port=8000)
+
+def reuseport_socket() -> socket.socket:
+    """Create a listening socket with SO_REUSEPORT, so many
+    processes can bind to the same address and the kernel
+    balances connections between them."""
+    host, port = lconfig.server_url
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(sock=None):
+    """Run the webserver and the bridge on this process' event loop."""
+    if sock is None:
+        host, port = lconfig.server_url
+        server = app.create_server(host=host, port=port)
+    else:
+        server = app.create_server(host=None, port=None, sock=sock)
+
     loop = asyncio.get_event_loop()
     bridge = Bridge(app, server, loop)
+    if lconfig.METRICS_PORT is not None:
+        metrics_port = lconfig.METRICS_PORT + snowflake.PROCESS_ID
+        asyncio.ensure_future(api.metrics.start_server(bridge, metrics_port))
+
     try:
         asyncio.ensure_future(bridge.init())
         loop.run_forever()
     except Exception:
         loop.stop()
 
+
+def worker_main(worker_id: int):
+    """Entrypoint for a worker process.
+
+    Each worker gets its own event loop, database pool,
+    litebridge connection and snowflake process id.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    snowflake.PROCESS_ID = worker_id
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    log.info('[worker:%d] starting, pid %d', worker_id, os.getpid())
+    serve(reuseport_socket())
+
+
+class Supervisor:
+    """Keeps a fixed amount of worker processes running,
+    restarting any that die."""
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.ctx = multiprocessing.get_context('fork')
+
+        # worker id -> process
+        self.procs = {}
+        self.stopping = False
+
+    def spawn(self, worker_id: int):
+        proc = self.ctx.Process(target=worker_main, args=(worker_id,),
+                                name=f'litecord-worker-{worker_id}')
+        proc.start()
+        self.procs[worker_id] = proc
+
+    def stop(self, *_):
+        log.info('Stopping workers')
+        self.stopping = True
+        for proc in self.procs.values():
+            if proc.is_alive():
+                proc.terminate()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+        while not self.stopping:
+            sentinels = {p.sentinel: wid for wid, p in self.procs.items()}
+            ready = multiprocessing.connection.wait(list(sentinels))
+            if self.stopping:
+                break
+
+            for sentinel in ready:
+                worker_id = sentinels[sentinel]
+                proc = self.procs[worker_id]
+                proc.join()
+
+                log.error('[worker:%d] died with exit code %r, restarting',
+                          worker_id, proc.exitcode)
+
+                # don't spin if something is broken at startup
+                time.sleep(WORKER_RESTART_DELAY)
+
+                # stop() could have run while we slept
+                if self.stopping:
+                    break
+
+                self.spawn(worker_id)
+
+        for proc in self.procs.values():
+            proc.join()
+
+
+def main():
+    """Main entrypoint"""
+    parser = argparse.ArgumentParser(description='Litecord REST')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='amount of worker processes to run')
+    args = parser.parse_args()
+
+    # the last process id is left for scripts like importusers
+    max_workers = snowflake.PROCESS_MASK
+    if not 1 <= args.workers <= max_workers:
+        parser.error(f'workers must be between 1 and {max_workers}')
+
+    add_prefixed_routes()
+
+    # workers fork from here, so they get it too
+    snowflake.WORKER_ID = lconfig.WORKER_ID
+
+    scale_buckets(args.workers)
+
+    if args.workers == 1:
+        serve()
+    else:
+        Supervisor(args.workers).run()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3.6
+
+"""
+importusers.py - bulk import users straight into the database.
+
+Reads users (email, password, username) from a CSV file with a header
+line, or from a JSONL file with one user object per line, and loads
+them in chunks with COPY. Passwords are hashed on a process pool.
+
+Progress is saved to <file>.checkpoint after every chunk, running
+the same command again resumes from there. Users whose email is
+already taken are skipped, so a chunk that was loaded right before
+an interruption is not imported twice.
+
+Usage, from the repository root:
+    python -m scripts.importusers users.csv [--chunk-size 1000]
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+import lconfig
+import utils.password as password
+import utils.snowflake as snowflake
+from db import QueryRegistry, USER_INSERT
+from gw import MAX_DISCRIM, DISCRIM_RETRIES
+from api.schemas import USERADD_SCHEMA
+
+log = logging.getLogger(__name__)
+
+
+def read_users(path: str, fmt: str):
+    """Stream users from a file, as dictionaries."""
+    with open(path, newline='', encoding='utf-8') as fp:
+        if fmt == 'csv':
+            yield from csv.DictReader(fp)
+            return
+
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def chunked(iterable, size: int):
+    """Split an iterable in lists of ``size`` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def hash_password(plain: str, scheme: str, cost: int) -> tuple:
+    """Hash a password with a new salt, giving ``(salt, hash)``.
+
+    Runs on the process pool.
+    """
+    salt = password.get_random_salt()
+    return salt, password.pwd_hash(plain, salt, scheme, cost)
+
+
+def pick_discrim(taken: set) -> str:
+    """Pick a random discriminator that isn't taken,
+    or ``None`` if there are none left."""
+    if len(taken) >= MAX_DISCRIM:
+        return None
+
+    offset = random.randrange(MAX_DISCRIM)
+    for n in range(MAX_DISCRIM):
+        discrim = f'{(n + offset) % MAX_DISCRIM + 1:04d}'
+        if discrim not in taken:
+            return discrim
+
+
+class Checkpoint:
+    """How many input rows were already handled."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> int:
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)['done']
+        except FileNotFoundError:
+            return 0
+
+    def save(self, done: int, stats: dict):
+        # write and rename, so an interruption can't
+        # leave a half-written checkpoint behind
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump({'done': done, 'stats': stats}, fp)
+
+        os.replace(tmp_path, self.path)
+
+
+class Importer:
+    """Imports chunks of users."""
+    def __init__(self, db: QueryRegistry, executor, *,
+                 scheme: str, cost: int):
+        self.db = db
+        self.executor = executor
+        self.scheme = scheme
+        self.cost = cost
+
+        # imported, and skipped:<reason> counts
+        self.stats = collections.Counter()
+
+    def _skip(self, reason: str, count: int=1):
+        self.stats[f'skipped:{reason}'] += count
+
+    def validate(self, users: list) -> list:
+        """Drop invalid users, and users repeating
+        an email from the same chunk."""
+        valid = {}
+        for user in users:
+            user = {field: user.get(field)
+                    for field in ('email', 'password', 'username')}
+
+            if not all(user.values()) or USERADD_SCHEMA.validate(user):
+                self._skip('invalid')
+            elif user['email'] in valid:
+                self._skip('duplicate')
+            else:
+                valid[user['email']] = user
+
+        return list(valid.values())
+
+    async def drop_taken(self, users: list) -> list:
+        """Drop users whose email is already in the database."""
+        rows = await self.db.fetch('emails_taken',
+                                   [user['email'] for user in users])
+        taken = {row['email'] for row in rows}
+        self._skip('email_taken', len(taken))
+
+        return [user for user in users if user['email'] not in taken]
+
+    async def hash_passwords(self, users: list) -> list:
+        """Hash the passwords of many users on the process pool."""
+        loop = asyncio.get_event_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(self.executor, hash_password,
+                                 user['password'], self.scheme, self.cost)
+            for user in users))
+
+    async def make_rows(self, users: list, hashes: list) -> list:
+        """Give users their IDs and discriminators, as rows
+        with the columns in ``db.USER_INSERT``."""
+        usernames = list({user['username'] for user in users})
+        rows = await self.db.fetch('discrims_taken', usernames)
+
+        taken = collections.defaultdict(set)
+        for row in rows:
+            taken[row['username']].add(row['discriminator'])
+
+        records = []
+        ids = snowflake.get_snowflakes(len(users))
+        for user_id, user, (salt, pwd_hash) in zip(ids, users, hashes):
+            username = user['username']
+            discrim = pick_discrim(taken[username])
+            if discrim is None:
+                self._skip('no_discriminator')
+                continue
+
+            taken[username].add(discrim)
+            records.append((str(user_id), username, discrim,
+                            user['email'], salt, pwd_hash))
+
+        return records
+
+    async def import_chunk(self, users: list):
+        """Import a chunk of users in one transaction."""
+        users = await self.drop_taken(self.validate(users))
+        if not users:
+            return
+
+        hashes = await self.hash_passwords(users)
+
+        # discriminators and emails can be taken by signups
+        # while we import, try again when that happens
+        for attempt in range(DISCRIM_RETRIES):
+            records = await self.make_rows(users, hashes)
+            try:
+                async with self.db.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.copy_records_to_table(
+                            'users', records=records, columns=USER_INSERT)
+            except asyncpg.UniqueViolationError:
+                log.warning('conflict loading a chunk, retrying [try: %d]',
+                            attempt + 1)
+
+                kept = {user['email'] for user in
+                        await self.drop_taken(users)}
+                pairs = [(user, pwd_hash)
+                         for user, pwd_hash in zip(users, hashes)
+                         if user['email'] in kept]
+                users = [user for user, _ in pairs]
+                hashes = [pwd_hash for _, pwd_hash in pairs]
+                if not users:
+                    return
+
+                continue
+
+            self.stats['imported'] += len(records)
+            return
+
+        raise Exception('Failed to load a chunk after '
+                        f'{DISCRIM_RETRIES} tries')
+
+
+async def run(args, fmt: str):
+    checkpoint = Checkpoint(f'{args.file}.checkpoint')
+    done = checkpoint.load()
+    if done:
+        print(f'resuming after {done} rows', file=sys.stderr)
+
+    db = QueryRegistry()
+    db.pool = await asyncpg.create_pool(init=db.prepare, **lconfig.pgargs)
+
+    executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+    importer = Importer(db, executor, scheme=lconfig.PASSWORD_SCHEME,
+                        cost=lconfig.PASSWORD_COST)
+
+    users = itertools.islice(read_users(args.file, fmt), done, None)
+    start = time.monotonic()
+    try:
+        for chunk in chunked(users, args.chunk_size):
+            await importer.import_chunk(chunk)
+            done += len(chunk)
+            checkpoint.save(done, dict(importer.stats))
+
+            elapsed = time.monotonic() - start
+            skipped = sum(count for key, count in importer.stats.items()
+                          if key.startswith('skipped:'))
+            print(f'{done} rows, {importer.stats["imported"]} imported, '
+                  f'{skipped} skipped, '
+                  f'{importer.stats["imported"] / elapsed:.1f} users/s',
+                  file=sys.stderr)
+    finally:
+        executor.shutdown()
+        await db.pool.close()
+
+    print(json.dumps(dict(importer.stats), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import users')
+    parser.add_argument('file', help='CSV or JSONL file with users')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='file format, guessed from its extension '
+                             'by default')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='users loaded in each transaction')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes hashing passwords')
+    parser.add_argument('--process-id', type=int,
+                        default=snowflake.PROCESS_MASK,
+                        help='snowflake process id to use, must not be '
+                             'used by a running worker (run.py leaves '
+                             'the default one free)')
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.file.endswith(('.jsonl', '.json')) else 'csv'
+
+    snowflake.WORKER_ID = lconfig.WORKER_ID
+    snowflake.PROCESS_ID = args.process_id
+
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run(args, fmt))
+    except KeyboardInterrupt:
+        print('interrupted, run again to resume', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
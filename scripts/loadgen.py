@@ -0,0 +1,378 @@
+#!/usr/bin/env python3.6
+
+"""
+loadgen.py - HTTP load generator for litecord rest.
+
+Runs a scenario (see scripts/scenarios/) against a running instance,
+either with a fixed amount of virtual users each running the scenario
+in a loop (--concurrency), or starting new scenario runs at a fixed
+rate (--rate). Reports latency percentiles and errors for each step.
+
+A scenario is a JSON file with:
+ - ``setup``: steps each virtual user runs once, like signing up.
+ - ``steps``: steps run on every iteration.
+
+Each step has a ``name``, ``method``, ``path``, and optionally ``json``,
+``headers``, ``expect`` (status codes counted as success, default any
+2xx/3xx) and ``save`` (variable name -> key path in the JSON response).
+Strings are templates with ``{run}``, ``{vu}`` (virtual user),
+``{iter}`` and every saved variable.
+
+The instance needs a database and a litebridge server. Use a throwaway
+database with the litecord schema, and the stand-in from
+bench.bridge_server (python -m bench.bridge_server).
+
+Every virtual user comes from the same IP, so the instance's ratelimits
+would answer most requests with 429 (auth:register allows 2 signups a
+minute). Turn them off with ``RATELIMIT_ENABLED = False`` in lconfig, or
+raise the ones in the way with ``RATELIMIT_GLOBAL`` and
+``RATELIMIT_OVERRIDES``, like ``{'auth:register': (100000, 1)}``.
+
+Usage, from the repository root:
+    python -m scripts.loadgen scripts/scenarios/signup_flow.json \\
+        [--url http://localhost:8000] [--concurrency 20 | --rate 50] \\
+        [--duration 30] [-o results.json]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+from bench import percentiles
+
+
+class HTTPError(Exception):
+    """The server gave a response we can't read."""
+    pass
+
+
+class HTTPConnection:
+    """A minimal keep-alive HTTP/1.1 client connection.
+
+    Only what the load generator needs, supporting both
+    Content-Length and chunked responses.
+    """
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def _read_body(self, status: int, headers: dict) -> bytes:
+        if status in (204, 304):
+            return b''
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    return bytes(body)
+
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()
+
+        if 'content-length' in headers:
+            return await self.reader.readexactly(
+                int(headers['content-length']))
+
+        body = await self.reader.read()
+        self.close()
+        return body
+
+    async def request(self, method: str, path: str, headers: dict=None,
+                      body: bytes=b'') -> tuple:
+        """Do one request, giving ``(status, headers, body)``."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1',
+                 f'Host: {self.host}:{self.port}',
+                 f'Content-Length: {len(body)}']
+        lines.extend(f'{key}: {value}'
+                     for key, value in (headers or {}).items())
+
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HTTPError('connection closed by the server')
+
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise HTTPError(f'bad status line {status_line!r}')
+
+        res_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            key, _, value = line.decode('latin-1').partition(':')
+            res_headers[key.strip().lower()] = value.strip()
+
+        res_body = await self._read_body(status, res_headers)
+        if res_headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return status, res_headers, res_body
+
+
+def render(template, variables: dict):
+    """Fill in the variables of a template, going into
+    lists and dictionaries."""
+    if isinstance(template, str):
+        return template.format_map(variables)
+
+    if isinstance(template, list):
+        return [render(item, variables) for item in template]
+
+    if isinstance(template, dict):
+        return {key: render(value, variables)
+                for key, value in template.items()}
+
+    return template
+
+
+def lookup(obj, path: str):
+    """Get a value out of a JSON object, by a
+    dot-separated key path like ``user.id``."""
+    for key in path.split('.'):
+        obj = obj[int(key)] if isinstance(obj, list) else obj[key]
+
+    return obj
+
+
+class Stats:
+    """Latencies and outcomes for every step."""
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+
+        # step name -> Counter of statuses and error names
+        self.outcomes = collections.defaultdict(collections.Counter)
+        self.errors = collections.Counter()
+
+        self.iterations = 0
+        self.dropped = 0
+
+    def record(self, step: str, latency: float, outcome, error: bool):
+        self.latencies[step].append(latency)
+        self.outcomes[step][outcome] += 1
+        if error:
+            self.errors[step] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        res = {}
+        for step, latencies in self.latencies.items():
+            pcts = percentiles(latencies)
+            res[step] = {
+                'count': len(latencies),
+                'errors': self.errors[step],
+                'per_sec': len(latencies) / elapsed,
+                'outcomes': {str(key): count for key, count
+                             in self.outcomes[step].items()},
+            }
+            res[step].update({key: value * 1000
+                              for key, value in pcts.items()})
+
+        return res
+
+
+class VirtualUser:
+    """Runs a scenario on its own connection, with its own variables."""
+    def __init__(self, vu_id: int, scenario: dict, url, stats: Stats,
+                 run_id: str):
+        self.scenario = scenario
+        self.stats = stats
+        self.conn = HTTPConnection(url.hostname, url.port or 80)
+        self.variables = {'run': run_id, 'vu': vu_id, 'iter': 0}
+
+    async def run_step(self, step: dict) -> bool:
+        """Run one step, giving False if it failed."""
+        name = step['name']
+        headers = render(step.get('headers', {}), self.variables)
+        body = b''
+        if 'json' in step:
+            body = json.dumps(render(step['json'], self.variables)).encode()
+            headers['Content-Type'] = 'application/json'
+
+        path = render(step['path'], self.variables)
+        start = time.perf_counter()
+        try:
+            status, _, res_body = await self.conn.request(
+                step.get('method', 'GET'), path, headers, body)
+        except (OSError, ValueError, asyncio.IncompleteReadError,
+                HTTPError) as err:
+            self.conn.close()
+            self.stats.record(name, time.perf_counter() - start,
+                              type(err).__name__, True)
+            return False
+
+        elapsed = time.perf_counter() - start
+        expect = step.get('expect')
+        ok = status in expect if expect else 200 <= status < 400
+
+        outcome = status
+        if ok and step.get('save'):
+            try:
+                payload = json.loads(res_body)
+                for var, key_path in step['save'].items():
+                    self.variables[var] = lookup(payload, key_path)
+            except (ValueError, KeyError, IndexError, TypeError):
+                ok, outcome = False, 'bad_body'
+
+        self.stats.record(name, elapsed, outcome, not ok)
+        return ok
+
+    async def run_steps(self, steps: list) -> bool:
+        for step in steps:
+            if not await self.run_step(step):
+                return False
+
+        return True
+
+    async def setup(self) -> bool:
+        return await self.run_steps(self.scenario.get('setup', []))
+
+    async def iteration(self) -> bool:
+        ok = await self.run_steps(self.scenario['steps'])
+        self.variables['iter'] += 1
+        self.stats.iterations += 1
+        return ok
+
+    def close(self):
+        self.conn.close()
+
+
+async def run_closed(scenario, url, stats, run_id, args):
+    """Closed model: ``concurrency`` users, each one
+    running the scenario again as soon as it finishes."""
+    deadline = time.monotonic() + args.duration
+
+    async def user(vu_id: int):
+        vu = VirtualUser(vu_id, scenario, url, stats, run_id)
+        try:
+            if not await vu.setup():
+                return
+
+            while time.monotonic() < deadline:
+                await vu.iteration()
+        finally:
+            vu.close()
+
+    await asyncio.gather(*(user(idx) for idx in range(args.concurrency)))
+
+
+async def run_open(scenario, url, stats, run_id, args):
+    """Open model: a new user every ``1 / rate`` seconds, no matter
+    how long the others take, with at most ``max_inflight``
+    running. Users that can't start are counted as dropped."""
+    inflight = asyncio.Semaphore(args.max_inflight)
+    tasks = []
+
+    async def user(vu_id: int):
+        vu = VirtualUser(vu_id, scenario, url, stats, run_id)
+        try:
+            if await vu.setup():
+                await vu.iteration()
+        finally:
+            vu.close()
+            inflight.release()
+
+    interval = 1 / args.rate
+    start = time.monotonic()
+    vu_id = 0
+    while True:
+        next_start = start + vu_id * interval
+        if next_start >= start + args.duration:
+            break
+
+        await asyncio.sleep(max(next_start - time.monotonic(), 0))
+        if inflight.locked():
+            stats.dropped += 1
+        else:
+            await inflight.acquire()
+            tasks.append(asyncio.ensure_future(user(vu_id)))
+
+        vu_id += 1
+
+    await asyncio.gather(*tasks)
+
+
+def report(summary: dict):
+    width = max((len(step) for step in summary), default=4)
+    print(f'{"step":<{width}}  {"count":>7}  {"errors":>6}  {"req/s":>8}  '
+          f'{"p50 ms":>8}  {"p95 ms":>8}  {"p99 ms":>8}')
+    for step, res in summary.items():
+        print(f'{step:<{width}}  {res["count"]:>7}  {res["errors"]:>6}  '
+              f'{res["per_sec"]:>8.1f}  {res["p50"]:>8.2f}  '
+              f'{res["p95"]:>8.2f}  {res["p99"]:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Litecord load generator')
+    parser.add_argument('scenario', help='scenario JSON file')
+    parser.add_argument('--url', default='http://localhost:8000')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=int, default=10,
+                      help='virtual users looping the scenario')
+    mode.add_argument('--rate', type=float,
+                      help='new virtual users per second')
+    parser.add_argument('--max-inflight', type=int, default=1000,
+                        help='with --rate, most users running at once')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to generate load for')
+    parser.add_argument('-o', '--output',
+                        help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    with open(args.scenario) as fp:
+        scenario = json.load(fp)
+
+    url = urllib.parse.urlparse(args.url)
+    stats = Stats()
+    run_id = os.urandom(4).hex()
+
+    runner = run_open if args.rate else run_closed
+    loop = asyncio.get_event_loop()
+    start = time.monotonic()
+    loop.run_until_complete(runner(scenario, url, stats, run_id, args))
+    elapsed = time.monotonic() - start
+
+    summary = stats.summary(elapsed)
+    report(summary)
+    print(f'{stats.iterations} iterations in {elapsed:.1f}s, '
+          f'{stats.dropped} dropped', file=sys.stderr)
+
+    if any(outcomes[429] for outcomes in stats.outcomes.values()):
+        print('got ratelimited, see RATELIMIT_ENABLED in lconfig',
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'scenario': scenario.get('name', args.scenario),
+                'elapsed': elapsed,
+                'iterations': stats.iterations,
+                'dropped': stats.dropped,
+                'steps': summary,
+            }, fp, indent=2)
+
+    return 1 if sum(stats.errors.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
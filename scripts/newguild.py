@@ -6,10 +6,18 @@ import requests
 API_BASE = 'http://localhost:8000'
 
 def main(args):
-    guild_name = args[1]
+    try:
+        token = args[1]
+        guild_name = args[2]
+    except IndexError:
+        print('usage: ./newguild.py <token> <guild name>')
+        return 1
 
-    r = requests.post(f'{API_BASE}/api/guilds', headers= json={
-        'name': guild_name
+    r = requests.post(f'{API_BASE}/api/guilds', headers={
+        'Authorization': token,
+    }, json={
+        'name': guild_name,
+        'region': 'local',
     })
 
     print(r)
@@ -0,0 +1,194 @@
+"""
+cache.py - in-process caching helpers
+
+    Bounded mappings used to keep hot data (tokens, users)
+    out of the database round trip.
+"""
+import time
+import collections
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A bounded mapping with least-recently-used eviction
+    and an optional time to live for its entries.
+
+    Arguments
+    ---------
+    maxsize: int
+        Maximum amount of entries held by the cache.
+    ttl: float, optional
+        Time in seconds an entry is considered fresh.
+        ``None`` means entries never expire.
+    """
+    def __init__(self, maxsize: int=1024, ttl: float=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key -> (expires_at, value)
+        self._data = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, _count=False) is not _MISSING
+
+    def _evict(self, key, value):
+        """Called whenever an entry is dropped from the cache.
+
+        Subclasses can override this to keep
+        secondary indexes in sync.
+        """
+        pass
+
+    def get(self, key, default=None, *, _count=True):
+        """Get one entry from the cache."""
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            if _count:
+                self.misses += 1
+            return default
+
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            self._evict(key, value)
+            if _count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if _count:
+            self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """Get one entry from the cache, without
+        counting it as a hit or a miss."""
+        return self.get(key, default, _count=False)
+
+    def set(self, key, value):
+        """Insert or replace one entry in the cache."""
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._evict(key, old[1])
+
+        self._data[key] = (expires, value)
+
+        while len(self._data) > self.maxsize:
+            old_key, (_, old_value) = self._data.popitem(last=False)
+            self.evictions += 1
+            self._evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        """Remove one entry from the cache, returning its value."""
+        try:
+            _, value = self._data.pop(key)
+        except KeyError:
+            return default
+
+        self._evict(key, value)
+        return value
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for key, (_, value) in list(self._data.items()):
+            self._evict(key, value)
+
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Get the cache counters."""
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class TokenCache(LRUCache):
+    """Cache of validated tokens.
+
+    Maps a token to the ``(user_id, user)`` tuple it was
+    validated against, and keeps a reverse index so every
+    token belonging to a user can be dropped when that user
+    changes (new salt, new username, etc).
+    """
+    def __init__(self, maxsize: int=1024, ttl: float=None):
+        super().__init__(maxsize, ttl)
+
+        # user_id -> set of tokens
+        self._by_user = collections.defaultdict(set)
+
+    def _evict(self, token, value):
+        user_id, _ = value
+        tokens = self._by_user.get(str(user_id))
+        if tokens is None:
+            return
+
+        tokens.discard(token)
+        if not tokens:
+            del self._by_user[str(user_id)]
+
+    def set(self, token, value):
+        super().set(token, value)
+        user_id, _ = value
+        self._by_user[str(user_id)].add(token)
+
+    def invalidate_user(self, user_id) -> int:
+        """Drop every cached token for a user.
+
+        Returns the amount of tokens dropped.
+        """
+        tokens = self._by_user.pop(str(user_id), set())
+        for token in tokens:
+            self._data.pop(token, None)
+
+        return len(tokens)
+
+
+class UserCache(LRUCache):
+    """Cache of user records, by ID and by email.
+
+    Keys are user IDs, an index keeps track of the ID
+    each email belongs to.
+
+    Changes made by other nodes only reach this cache if the
+    litebridge server relays their ``USER_UPDATE`` dispatches,
+    so entries should have a ``ttl`` bounding how stale they get
+    when it doesn't, or when the link is down.
+    """
+    def __init__(self, maxsize: int=1024, ttl: float=None):
+        super().__init__(maxsize, ttl)
+
+        # email -> user id
+        self._by_email = {}
+
+    def _evict(self, user_id, user):
+        if self._by_email.get(user['email']) == user_id:
+            del self._by_email[user['email']]
+
+    def set(self, user_id, user):
+        super().set(user_id, user)
+        self._by_email[user['email']] = user_id
+
+    def get_by_email(self, email: str):
+        """Get one user by email."""
+        user_id = self._by_email.get(email)
+        if user_id is None:
+            self.misses += 1
+            return None
+
+        return self.get(user_id)
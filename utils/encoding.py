@@ -0,0 +1,125 @@
+"""
+encoding.py - litebridge frame encodings
+
+    Frames are JSON text by default. During the hello handshake
+    the server can advertise other encodings and compression,
+    and we pick the best one we both support.
+"""
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _json_encode(obj) -> str:
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _msgpack_encode(obj) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _msgpack_decode(data: bytes):
+    return msgpack.unpackb(data, raw=False)
+
+
+# encoding name -> (encoder, decoder)
+ENCODINGS = {
+    'json': (_json_encode, json.loads),
+}
+
+if msgpack is not None:
+    ENCODINGS['msgpack'] = (_msgpack_encode, _msgpack_decode)
+
+COMPRESSIONS = ('zlib-stream',)
+
+
+class Codec:
+    """Encoder and decoder for the frames of one connection.
+
+    With ``zlib-stream`` compression, both sides keep a single
+    zlib stream for the whole connection and every frame is
+    sync-flushed, so one codec must never be shared between
+    connections.
+
+    Text frames are always decoded as JSON, so packets sent
+    before the handshake (or by an old peer) still work.
+    """
+    def __init__(self, encoding: str='json', compress: str=None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f'Unsupported encoding {encoding!r}')
+
+        if compress is not None and compress not in COMPRESSIONS:
+            raise ValueError(f'Unsupported compression {compress!r}')
+
+        self.encoding = encoding
+        self.compress = compress
+        self._encode, self._decode = ENCODINGS[encoding]
+
+        self._deflate = None
+        self._inflate = None
+        if compress:
+            self._deflate = zlib.compressobj()
+            self._inflate = zlib.decompressobj()
+
+    def __repr__(self):
+        return f'<Codec encoding={self.encoding} compress={self.compress}>'
+
+    def encode(self, obj):
+        """Encode one packet into a frame."""
+        data = self._encode(obj)
+        if self._deflate is None:
+            return data
+
+        if isinstance(data, str):
+            data = data.encode()
+
+        return (self._deflate.compress(data) +
+                self._deflate.flush(zlib.Z_SYNC_FLUSH))
+
+    def decode(self, frame):
+        """Decode one frame into a packet."""
+        if isinstance(frame, str):
+            return json.loads(frame)
+
+        if self._inflate is not None:
+            frame = self._inflate.decompress(frame)
+
+        if self.encoding == 'json':
+            frame = frame.decode()
+
+        return self._decode(frame)
+
+
+def negotiate(hello: dict, encodings: list, compress: bool) -> Codec:
+    """Pick a codec from the server's hello packet.
+
+    Parameters
+    ----------
+    hello: dict
+        The OP.hello packet. Servers that support other encodings
+        list them in ``encodings`` and compression methods
+        in ``compress``.
+    encodings: list
+        Our preferred encodings, best first.
+    compress: bool
+        If we want compression, when available.
+    """
+    offered = hello.get('encodings') or ['json']
+    encoding = 'json'
+    for name in encodings:
+        if name in offered and name in ENCODINGS:
+            encoding = name
+            break
+
+    compression = None
+    if compress:
+        for name in COMPRESSIONS:
+            if name in (hello.get('compress') or []):
+                compression = name
+                break
+
+    return Codec(encoding, compression)
@@ -0,0 +1,115 @@
+"""
+loader.py - batching and single-flight loads
+
+    Concurrent loads of the same key share one in-flight lookup,
+    and distinct keys requested in the same event loop iteration
+    are fetched together in one batch.
+"""
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Loader:
+    """Coalesces loads of keys into batched lookups.
+
+    Arguments
+    ---------
+    batch_func: coroutine function
+        Receives a list of keys and returns a dict
+        mapping each key to its value. Missing keys load as ``None``.
+    max_batch: int, optional
+        Maximum amount of keys given to ``batch_func`` at once.
+    """
+    def __init__(self, batch_func, *, max_batch: int=None):
+        self.batch_func = batch_func
+        self.max_batch = max_batch
+
+        # keys waiting for the next batch, and keys
+        # already in a batch waiting for its result.
+        # key -> future
+        self._queue = {}
+        self._inflight = {}
+        self._scheduled = False
+
+        self.loads = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.keys_fetched = 0
+        self.max_batch_size = 0
+
+    async def load(self, key):
+        """Load one key."""
+        self.loads += 1
+
+        fut = self._inflight.get(key) or self._queue.get(key)
+        if fut is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_event_loop()
+            fut = loop.create_future()
+            self._queue[key] = fut
+
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._dispatch)
+
+        # the future is shared, one caller being cancelled
+        # must not cancel it for everyone else
+        return await asyncio.shield(fut)
+
+    async def load_many(self, keys) -> list:
+        """Load many keys, in one batch when possible."""
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self):
+        """Start batches for every queued key."""
+        queue, self._queue = self._queue, {}
+        self._scheduled = False
+
+        keys = list(queue)
+        size = self.max_batch or len(keys)
+        for idx in range(0, len(keys), size):
+            batch = {key: queue[key] for key in keys[idx:idx + size]}
+            self._inflight.update(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: dict):
+        self.batches += 1
+        self.keys_fetched += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+
+        try:
+            res = await self.batch_func(list(batch))
+        except Exception as err:
+            log.exception('Error loading a batch of %d keys', len(batch))
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(err)
+                    fut.exception()
+        else:
+            for key, fut in batch.items():
+                if not fut.done():
+                    fut.set_result(res.get(key))
+        finally:
+            for key in batch:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        """Get the loader counters.
+
+        ``coalescing_ratio`` is the amount of loads for each key
+        actually fetched, higher is better.
+        """
+        return {
+            'loads': self.loads,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'keys_fetched': self.keys_fetched,
+            'max_batch_size': self.max_batch_size,
+            'mean_batch_size': (self.keys_fetched / self.batches
+                                if self.batches else 0.),
+            'coalescing_ratio': (self.loads / self.keys_fetched
+                                 if self.keys_fetched else 0.),
+        }
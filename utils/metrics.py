@@ -0,0 +1,164 @@
+"""
+metrics.py - Prometheus metrics
+
+    Counters, gauges and histograms rendered in the Prometheus
+    text exposition format.
+
+    Metrics are only touched from the event loop of their process,
+    so updating one is a couple of dict and list operations,
+    without any locks.
+"""
+import bisect
+import math
+
+# seconds, good for request latencies
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75,
+                   1., 2.5, 5., 7.5, 10.)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+
+    pairs = ','.join(f'{name}="{_escape(value)}"'
+                     for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+def _number(value) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for metrics.
+
+    Arguments
+    ---------
+    name: str
+        Metric name.
+    doc: str
+        Help text.
+    labelnames: tuple, optional
+        Names of the labels, their values are given
+        in the same order when updating the metric.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, doc: str, labelnames: tuple=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+
+        # label values -> value
+        self._values = {}
+
+    def _render_values(self, lines: list):
+        for labels, value in self._values.items():
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} '
+                         f'{_number(value)}')
+
+    def render(self, lines: list):
+        """Add the lines of this metric to ``lines``."""
+        lines.append(f'# HELP {self.name} {self.doc}')
+        lines.append(f'# TYPE {self.name} {self.kind}')
+        self._render_values(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float=1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def set_total(self, value: float, *labels):
+        """Set the value, for totals counted somewhere else."""
+        self._values[labels] = value
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Counts observations in buckets.
+
+    Each bucket counts observations less than or equal to its bound.
+    Counts are kept per bucket and only made cumulative when rendered,
+    so an observation updates one bucket instead of all of them.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, doc: str, labelnames: tuple=(),
+                 buckets: tuple=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # [counts for each bucket and +Inf, sum]
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1),
+                                             0.]
+
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def _render_values(self, lines: list):
+        names = self.labelnames + ('le',)
+        bounds = self.buckets + (math.inf,)
+
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket'
+                             f'{_labels(names, labels + (_number(bound),))} '
+                             f'{cumulative}')
+
+            label_str = _labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_number(total)}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+
+
+class Registry:
+    """A set of metrics exposed together."""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        """Render every metric in the text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
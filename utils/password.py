@@ -1,10 +1,31 @@
+import asyncio
+import concurrent.futures
 import hashlib
+import hmac
 import os
 import base64
 
 import sha3
 from random import randint
 
+# scheme used for new hashes, and its cost
+# (iterations, for pbkdf2_sha256)
+DEFAULT_SCHEME = 'pbkdf2_sha256'
+DEFAULT_COST = 100000
+
+# executor running the hashes, and a cap on how many hashes
+# can be queued or running in it. hashes over the cap are
+# rejected with HashingBusy, so a login flood can't queue up
+# an unbounded amount of work
+_executor = None
+_max_pending = 8
+_pending = 0
+
+
+class HashingBusy(Exception):
+    """Too many hashes are already queued or running."""
+    pass
+
 
 async def random_digits(n: int) -> str:
     """Returns `n` random digits"""
@@ -18,6 +39,130 @@ def get_random_salt(size: int=64) -> str:
     return base64.b64encode(os.urandom(size)).decode()
 
 
-def pwd_hash(plain: str, salt: str) -> str:
-    """Generate a hash for a password using SHA3-512."""
+def _sha3_512(plain: str, salt: str, cost: int) -> str:
     return hashlib.sha3_512(f'{plain}{salt}'.encode()).hexdigest()
+
+
+def _pbkdf2_sha256(plain: str, salt: str, cost: int) -> str:
+    return hashlib.pbkdf2_hmac('sha256', plain.encode(),
+                               salt.encode(), cost).hex()
+
+
+# scheme name -> function(plain, salt, cost)
+SCHEMES = {
+    'sha3_512': _sha3_512,
+    'pbkdf2_sha256': _pbkdf2_sha256,
+}
+
+
+def _parse(stored: str) -> tuple:
+    """Split a stored hash into (scheme, cost, digest).
+
+    Hashes made before schemes existed are plain
+    SHA3-512 hex digests, with no prefix.
+    """
+    if '$' not in stored:
+        return 'sha3_512', 0, stored
+
+    scheme, cost, digest = stored.split('$')
+    return scheme, int(cost), digest
+
+
+def pwd_hash(plain: str, salt: str, scheme: str=None,
+             cost: int=None) -> str:
+    """Generate a hash for a password.
+
+    The result is ``scheme$cost$digest``, so the scheme and
+    its cost can change without breaking older hashes.
+    """
+    scheme = scheme or DEFAULT_SCHEME
+    cost = cost or DEFAULT_COST
+
+    digest = SCHEMES[scheme](plain, salt, cost)
+    return f'{scheme}${cost}${digest}'
+
+
+def pwd_verify(plain: str, salt: str, stored: str) -> bool:
+    """Check a password against a stored hash."""
+    scheme, cost, digest = _parse(stored)
+    given = SCHEMES[scheme](plain, salt, cost)
+    return hmac.compare_digest(given, digest)
+
+
+def needs_rehash(stored: str) -> bool:
+    """Check if a stored hash is not using the current scheme
+    and cost, meaning it should be upgraded."""
+    scheme, cost, _ = _parse(stored)
+    return scheme != DEFAULT_SCHEME or cost != DEFAULT_COST
+
+
+def configure(scheme: str=None, cost: int=None, executor: str='thread',
+              workers: int=None, max_pending: int=None):
+    """Configure password hashing.
+
+    Parameters
+    ----------
+    scheme: str, optional
+        Scheme for new hashes, one of :data:`SCHEMES`.
+    cost: int, optional
+        Cost for the scheme.
+    executor: str
+        ``'thread'`` or ``'process'``, the kind of pool hashes run on.
+    workers: int, optional
+        Size of the pool.
+    max_pending: int, optional
+        Maximum amount of hashes queued or running at once,
+        more than that raise :class:`HashingBusy`.
+    """
+    global DEFAULT_SCHEME, DEFAULT_COST, _executor, _max_pending
+
+    if scheme is not None:
+        if scheme not in SCHEMES:
+            raise ValueError(f'Unknown password scheme {scheme!r}')
+        DEFAULT_SCHEME = scheme
+
+    if cost is not None:
+        DEFAULT_COST = cost
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+
+    if executor == 'process':
+        _executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        _executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    if max_pending is not None:
+        _max_pending = max_pending
+
+
+async def _run(func, *args):
+    """Run a hashing function in the executor.
+
+    Raises
+    ------
+    HashingBusy
+        If ``max_pending`` hashes are already queued or running.
+    """
+    global _pending
+    if _pending >= _max_pending:
+        raise HashingBusy()
+
+    loop = asyncio.get_event_loop()
+    _pending += 1
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def pwd_hash_async(plain: str, salt: str) -> str:
+    """Generate a hash for a password, without blocking
+    the event loop."""
+    return await _run(pwd_hash, plain, salt, DEFAULT_SCHEME, DEFAULT_COST)
+
+
+async def pwd_verify_async(plain: str, salt: str, stored: str) -> bool:
+    """Check a password against a stored hash, without blocking
+    the event loop."""
+    return await _run(pwd_verify, plain, salt, stored)
@@ -8,12 +8,30 @@ import time
 import hashlib
 import os
 import base64
+import threading
 
 # encoded in ms
 EPOCH = 1420070400000
 
+# bit layout, from the least significant bits:
+# 12 bits of sequence, 5 of process id, 5 of worker id,
+# and 42 bits of (timestamp - EPOCH)
+SEQUENCE_BITS = 12
+PROCESS_BITS = 5
+WORKER_BITS = 5
+
+PROCESS_SHIFT = SEQUENCE_BITS
+WORKER_SHIFT = SEQUENCE_BITS + PROCESS_BITS
+TIMESTAMP_SHIFT = SEQUENCE_BITS + PROCESS_BITS + WORKER_BITS
+
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+PROCESS_MASK = (1 << PROCESS_BITS) - 1
+WORKER_MASK = (1 << WORKER_BITS) - 1
+
 # internal state
 _generated_ids = 0
+_last_timestamp = -1
+_lock = threading.Lock()
 PROCESS_ID = 1
 WORKER_ID = 1
 
@@ -36,6 +54,8 @@ def _snowflake(timestamp: int) -> Snowflake:
     to this function will generate a different snowflake,
     even with the same timestamp.
 
+    The caller must hold ``_lock``.
+
     Arguments
     ---------
     timestamp: int
@@ -45,46 +65,102 @@ def _snowflake(timestamp: int) -> Snowflake:
     """
     global _generated_ids
 
-    # bits 0-12 encode _generated_ids (size 12)
-    genid_b = '{0:012b}'.format(_generated_ids)
+    snowflake = ((timestamp - EPOCH) << TIMESTAMP_SHIFT) \
+        | ((WORKER_ID & WORKER_MASK) << WORKER_SHIFT) \
+        | ((PROCESS_ID & PROCESS_MASK) << PROCESS_SHIFT) \
+        | _generated_ids
+
+    _generated_ids = (_generated_ids + 1) & SEQUENCE_MASK
+    return snowflake
 
-    # bits 12-17 encode PROCESS_ID (size 5)
-    procid_b = '{0:05b}'.format(PROCESS_ID)
 
-    # bits 17-22 encode WORKER_ID (size 5)
-    workid_b = '{0:05b}'.format(WORKER_ID)
+def _next_timestamp() -> int:
+    """Get the timestamp for the next snowflake.
 
-    # bits 22-64 encode (timestamp - EPOCH) (size 42)
-    epochized = timestamp - EPOCH
-    epoch_b = '{0:042b}'.format(epochized)
+    Resets the sequence on every new millisecond, and waits
+    for the next one when the current one has no ids left.
+    The caller must hold ``_lock``.
+    """
+    global _generated_ids, _last_timestamp
 
-    snowflake_b = f'{epoch_b}{workid_b}{procid_b}{genid_b}'
-    _generated_ids += 1
-    return int(snowflake_b, 2)
+    timestamp = int(time.time() * 1000)
+
+    # the clock went backwards, keep using the last timestamp
+    # so we never repeat an id
+    if timestamp < _last_timestamp:
+        timestamp = _last_timestamp
+
+    if timestamp == _last_timestamp:
+        if _generated_ids == 0:
+            # sequence wrapped around, every id for
+            # this millisecond was already given
+            while timestamp <= _last_timestamp:
+                time.sleep(0.0001)
+                timestamp = int(time.time() * 1000)
+    else:
+        _generated_ids = 0
+
+    _last_timestamp = timestamp
+    return timestamp
 
 
 def snowflake_time(snowflake: Snowflake) -> float:
     """Get the UNIX timestamp(with millisecond precision, as a float)
     from a specific snowflake.
-    """
-
-    # the total size for a snowflake is 64 bits,
-    # considering it is a string, position 0 to 42 will give us
-    # the `epochized` variable
-    snowflake_b = '{0:064b}'.format(snowflake)
-    epochized_b = snowflake_b[:42]
-    epochized = int(epochized_b, 2)
 
-    # since epochized is the time *since* the EPOCH
-    # the unix timestamp will be the time *plus* the EPOCH
-    timestamp = epochized + EPOCH
+    Only uses arithmetic, so this also works on whole
+    arrays of snowflakes (e.g. numpy int64 arrays).
+    """
+    # the top 42 bits are the time *since* the EPOCH,
+    # the unix timestamp is that *plus* the EPOCH.
 
     # convert it to seconds
     # since we don't want to break the entire
     # snowflake interface
-    return timestamp / 1000
+    return ((snowflake >> TIMESTAMP_SHIFT) + EPOCH) / 1000
+
+
+def snowflake_times(snowflakes) -> list:
+    """Get the UNIX timestamps of many snowflakes at once."""
+    return [((snowflake >> TIMESTAMP_SHIFT) + EPOCH) / 1000
+            for snowflake in snowflakes]
+
+
+def snowflake_worker(snowflake: Snowflake) -> int:
+    """Get the worker id that generated a snowflake."""
+    return (snowflake >> WORKER_SHIFT) & WORKER_MASK
+
 
+def snowflake_process(snowflake: Snowflake) -> int:
+    """Get the process id that generated a snowflake."""
+    return (snowflake >> PROCESS_SHIFT) & PROCESS_MASK
 
-def get_snowflake():
+
+def get_snowflake() -> Snowflake:
     """Generate a snowflake"""
-    return _snowflake(int(time.time() * 1000))
+    with _lock:
+        return _snowflake(_next_timestamp())
+
+
+def get_snowflakes(count: int) -> list:
+    """Generate many snowflakes at once.
+
+    This takes the lock only once, so it is much cheaper
+    than calling :func:`get_snowflake` ``count`` times.
+    """
+    snowflakes = []
+    with _lock:
+        while len(snowflakes) < count:
+            timestamp = _next_timestamp()
+            snowflakes.append(_snowflake(timestamp))
+
+            # fill the rest of this millisecond in one go
+            left = min(count - len(snowflakes),
+                       (SEQUENCE_MASK + 1) - _generated_ids)
+            if _generated_ids == 0:
+                left = 0
+
+            snowflakes.extend(_snowflake(timestamp)
+                              for _ in range(left))
+
+    return snowflakes